@@ -13,6 +13,7 @@ __version__ = '1'
 # Imports
 #------------------------------------------------------------------------------
 from collections import deque
+from itertools import count
 
 #------------------------------------------------------------------------------
 # Node implementation
@@ -88,9 +89,13 @@ class Node(object):
 class Graph(object):
     """A representation of graphs as a collection of nodes."""
 
+    _uids = count() # Unique identifiers for graph fingerprints
+
     def __init__(self, directed=False):
         self._nodes = dict()
         self._directed = directed
+        self._uid = next(Graph._uids)
+        self._version = 0
 
     def __str__(self):
         """Return an informal description of the graph"""
@@ -107,10 +112,23 @@ class Graph(object):
         """Return the collection of nodes in the graph."""
         return self._nodes.values()
 
+    def version(self):
+        """Return a counter that changes whenever nodes or edges are added."""
+        return self._version
+
+    def fingerprint(self):
+        """Return a (graph id, version) pair identifying the graph's state.
+
+        Only changes made through the graph are tracked. Adding edges
+        directly to nodes does not change the fingerprint.
+        """
+        return (self._uid, self._version)
+
     def add_node(self, node):
         """Add a node to the graph."""
-        if node.id() not in self._nodes.keys():  # don't overwrite nodes
+        if node.id() not in self._nodes:  # don't overwrite nodes
             self._nodes[node.id()] = node
+            self._version += 1
 
     def find_node(self, node_id):
         """Return the node for the given id."""
@@ -126,6 +144,7 @@ class Graph(object):
         """
         self.add_node(node1)
         self.add_node(node2)
+        self._version += 1
         node1.add_outgoing(node2)
         node2.add_incoming(node1)
         if not self._directed:
@@ -186,3 +205,56 @@ class Graph(object):
 
         return set(filter(lambda x : x.is_singleton(), 
             self._nodes.itervalues()))
+
+#------------------------------------------------------------------------------
+# Disjoint sets of nodes
+#------------------------------------------------------------------------------
+class DisjointSets(object):
+    """Disjoint sets of node ids, using union by size and path halving.
+
+    Useful for keeping track of connected components while edges are
+    added, without searching the graph again.
+    """
+
+    def __init__(self):
+        self._parent = dict()
+        self._size = dict()
+
+    def __contains__(self, node_id):
+        return node_id in self._parent
+
+    def add(self, node_id):
+        """Add a singleton set for node_id if it is not already present."""
+        if node_id not in self._parent:
+            self._parent[node_id] = node_id
+            self._size[node_id] = 1
+
+    def find(self, node_id):
+        """Return the representative of the set containing node_id."""
+        parent = self._parent
+        while parent[node_id] != node_id:
+            parent[node_id] = parent[parent[node_id]]
+            node_id = parent[node_id]
+
+        return node_id
+
+    def union(self, node_id1, node_id2):
+        """Merge the sets containing both ids, returning the new root."""
+        root1 = self.find(node_id1)
+        root2 = self.find(node_id2)
+        if root1 == root2:
+            return root1
+
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size.pop(root2)
+        return root1
+
+    def size(self, node_id):
+        """Return the size of the set containing node_id."""
+        return self._size[self.find(node_id)]
+
+    def roots(self):
+        """Return the representatives of all sets."""
+        return self._size.keys()
@@ -13,8 +13,17 @@ __version__ = '1'
 # Imports
 #------------------------------------------------------------------------------
 import graph # Our basic graph implementation
+import csv
+import errno
+import fcntl
+import gc
 import json
-from collections import deque
+import os
+import sqlite3
+import sys
+import time
+import weakref
+from collections import deque, OrderedDict
 from argparse import ArgumentParser
 
 #------------------------------------------------------------------------------
@@ -23,6 +32,12 @@ from argparse import ArgumentParser
 class User(graph.Node):
     """Model users as graph nodes with some special methods."""
 
+    # Feature indexes to keep up to date. They are held by the class
+    # rather than by each user, since an extra instance attribute pushes
+    # the instance dictionary past its smallest size, costing hundreds
+    # of bytes per user.
+    feature_indexes = weakref.WeakSet()
+
     def __init__(self, id, features=set()):
         """Initialize a user with a set of features."""
         _features = set() | features
@@ -35,10 +50,16 @@ class User(graph.Node):
     def add_feature(self, feature):
         """Add a web site feature to this user."""
         self.data().add(feature)
+        if len(User.feature_indexes) > 0:
+            for feature_index in User.feature_indexes:
+                feature_index.add(feature, self)
 
     def discard_feature(self, feature):
         """Discard a feature from this user."""
         self.data().discard(feature)
+        if len(User.feature_indexes) > 0:
+            for feature_index in User.feature_indexes:
+                feature_index.discard(feature, self)
 
     def update_feature(self, feature):
         """Adds or discards a feature. Discards if feature starts with !"""
@@ -55,6 +76,68 @@ class User(graph.Node):
         """Return the set of users this user is coached by"""
         return self.incoming()
 
+#------------------------------------------------------------------------------
+# Feature index
+#------------------------------------------------------------------------------
+class FeatureIndex(object):
+    """An inverted index from features to the users that have them.
+
+    The index registers itself in User.feature_indexes while it is in
+    use, and users of the indexed coaching graph keep it up to date as
+    features are added or discarded. Features that users added to the
+    graph after the index was built already had are not indexed.
+    """
+
+    def __init__(self, coaching_graph):
+        """Index the features of all users in coaching_graph."""
+        self._graph = coaching_graph
+        self._users = dict()
+        for user in coaching_graph.nodes():
+            for feature in user.features():
+                self.add(feature, user)
+        User.feature_indexes.add(self)
+
+    def _indexes(self, user):
+        """Return whether user belongs to the indexed coaching graph."""
+        try:
+            return self._graph.find_node(user.id()) is user
+        except KeyError:
+            return False
+
+    def add(self, feature, user):
+        """Record that user has feature."""
+        if self._indexes(user):
+            self._users.setdefault(feature, set()).add(user)
+
+    def discard(self, feature, user):
+        """Record that user no longer has feature."""
+        users = self._users.get(feature)
+        if users is not None:
+            users.discard(user)
+            if len(users) == 0:
+                del self._users[feature]
+
+    def features(self):
+        """Return the features at least one user has."""
+        return self._users.keys()
+
+    def users(self, feature):
+        """Return the set of users with feature. Do not modify it."""
+        return self._users.get(feature, frozenset())
+
+    def count(self, feature):
+        """Return the number of users with feature."""
+        return len(self.users(feature))
+
+    def users_with_without(self, feature, other_feature):
+        """Return the users with feature but not other_feature."""
+        return self.users(feature) - self.users(other_feature)
+
+    def component_coverage(self, feature, components):
+        """Return (infected, size) pairs for feature in each component."""
+        users = self.users(feature)
+        return [(len(users.intersection(x)), len(x)) for x in components]
+
 #------------------------------------------------------------------------------
 # Functions for performing infections
 #------------------------------------------------------------------------------
@@ -77,8 +160,33 @@ def trim_infections(infections, delta):
 
     return trimmed
 
-def approx_component_infection(coaching_graph, min_users, max_users):
-    """Find a collection of components to infect, getting to min_users."""
+def trim_subtotals(subtotals, delta):
+    """Trim (total, indices) pairs so their totals are a factor of delta apart.
+    """
+
+    trimmed = [subtotals[0]] # Should always be the empty subset.
+    last = float(subtotals[0][0])
+    for i in range(1,len(subtotals)):
+        if subtotals[i][0] > last * (1.0 + delta):
+            trimmed.append(subtotals[i])
+            last = float(subtotals[i][0])
+
+    return trimmed
+
+def approx_subset_sum(sizes, min_total, max_total, epsilon=None):
+    """Return indices of sizes whose sum is close to, but at most, max_total.
+
+    The sizes are those of disjoint groups of users, such as connected
+    components, so a collection of groups is represented by the sum of
+    its sizes and the indices chosen. Only the sizes are needed, which
+    allows planning without holding the users themselves in memory.
+
+    Groups of equal size are interchangeable, so they are bundled in
+    counts of 1, 2, 4 and so on, which can make up any number of them.
+    Subtotals closer than a factor of epsilon / (2m) are trimmed, where
+    m is the number of bundles. By default epsilon is
+    max_total / min_total - 1.
+    """
 
     # This uses an approach similar to the approximate subset sum
     # algorithm. A list of potentially acceptable collections is
@@ -87,27 +195,71 @@ def approx_component_infection(coaching_graph, min_users, max_users):
     # guaranteed to find at least one infection within the range
     # if one exists.
     #
-    # The speed of this approach depends on the min and max number 
+    # The speed of this approach depends on the min and max number
     # of users. The bigger the range, the faster this is likely to be.
-    # The closer we're required to be to the exact answer, the more 
-    # candidate infections need to be maintained (i.e. less trimming 
-    # allowed) and the more memory is used as well.
-    seeds = coaching_graph.all_connected_components()
-    epsilon = (float(max_users) / min_users) - 1.0
-    n = len(seeds)
+    # The closer we're required to be to the exact answer, the more
+    # candidate infections need to be maintained (i.e. less trimming
+    # allowed) and the more memory is used as well. Each candidate
+    # only adds a link (bundle, previous link) to the candidate it
+    # extends, so extending one costs the same however many bundles it
+    # already has.
+    if epsilon is None:
+        epsilon = (float(max_total) / min_total) - 1.0
 
-    infections = [set()] # Start with the empty set
-    for seed in seeds:
-        new_infections = [x | set(seed) for x in infections]
-        new_infections = filter(lambda x : len(x) <= max_users, new_infections)
-        infections.extend(new_infections)
-        infections.sort(key=lambda x : len(x))
-        infections = trim_infections(infections, epsilon / (2.0 * n))
+    indices = dict() # Indices of the groups of each size
+    for i, size in enumerate(sizes):
+        indices.setdefault(size, []).append(i)
 
-    return infections.pop()
+    bundles = [] # (size, count) pairs
+    for size in sorted(indices.keys(), reverse=True):
+        remaining = len(indices[size])
+        count = 1
+        while remaining > 0:
+            count = min(count, remaining)
+            bundles.append((size, count))
+            remaining -= count
+            count *= 2
+    m = max(len(bundles), 1)
+
+    subtotals = [(0, None)] # Start with the empty subset
+    for b, (size, count) in enumerate(bundles):
+        weight = size * count
+        new_subtotals = [(total + weight, (b, links))
+                for (total, links) in subtotals if total + weight <= max_total]
+        subtotals.extend(new_subtotals)
+        subtotals.sort(key=lambda x : x[0])
+        subtotals = trim_subtotals(subtotals, epsilon / (2.0 * m))
+
+    chosen = []
+    links = subtotals.pop()[1]
+    while links is not None:
+        b, links = links
+        size, count = bundles[b]
+        for j in range(count):
+            chosen.append(indices[size].pop())
+
+    return chosen
+
+def approx_component_infection(coaching_graph, min_users, max_users,
+        seeds=None, epsilon=None):
+    """Find a collection of components to infect, getting to min_users.
+
+    Components are considered in the order of seeds, all the components
+    of the graph by default. epsilon is passed on to approx_subset_sum.
+    """
+
+    if seeds is None:
+        seeds = cached_components(coaching_graph)
+    sizes = [len(x) for x in seeds]
+    users = set()
+    for i in approx_subset_sum(sizes, min_users, max_users, epsilon):
+        users.update(seeds[i])
 
+    return users
 
-def approx_class_infection(coaching_graph, seeds, min_users, max_users):
+
+def approx_class_infection(coaching_graph, seeds, min_users, max_users,
+        epsilon=None):
     """Find a collection of users to infect, starting with seeds"""
 
     # This uses an approach similar to the approximate subset sum
@@ -122,7 +274,8 @@ def approx_class_infection(coaching_graph, seeds, min_users, max_users):
     # The closer we're required to be to the exact answer, the more 
     # candidate infections need to be maintained (i.e. less trimming 
     # allowed) and the more memory is used as well.
-    epsilon = (float(max_users) / min_users) - 1.0
+    if epsilon is None:
+        epsilon = (float(max_users) / min_users) - 1.0
     n = len(seeds)
 
     infections = [set()] # Start with the empty set
@@ -136,18 +289,19 @@ def approx_class_infection(coaching_graph, seeds, min_users, max_users):
 
     return infections.pop()
 
-def limited_infection(coaching_graph, feature, min_users, max_users):
-    """Perform a limited infection, between minimum and maximum users.
+def plan_limited_infection(coaching_graph, min_users, max_users):
+    """Plan a limited infection, between minimum and maximum users.
 
-    Limited infections first infect entire components then infect
-    classes, starting with coaches and their students (ignoring
-    transitivity and "is coached by" relationships). If a limited infection
-    exists between the minimum and maximum number of users (inclusive), 
-    it will be performed.
-    
-    Returns True if the infection was successful, False otherwise.
+    Returns a frozenset of users to infect, chosen as in limited_infection,
+    or None if no such infection was found. Plans are memoized in
+    plan_cache for each version of the coaching graph.
     """
 
+    key = plan_cache.key(coaching_graph, "limited", min_users, max_users)
+    found, users = plan_cache.get(key)
+    if found:
+        return users
+
     users = approx_component_infection(coaching_graph, min_users, max_users)
     if len(users) < min_users:
         # Component infection didn't infect enough users. Move to class
@@ -161,8 +315,33 @@ def limited_infection(coaching_graph, feature, min_users, max_users):
         users |= class_users
 
     if len(users) >= min_users:
-        for user in users:
-            user.update_feature(feature)
+        users = frozenset(users)
+    else:
+        users = None
+
+    plan_cache.put(key, users)
+    return users
+
+def apply_infection(users, feature):
+    """Update the feature of each planned user."""
+    for user in users:
+        user.update_feature(feature)
+
+def limited_infection(coaching_graph, feature, min_users, max_users):
+    """Perform a limited infection, between minimum and maximum users.
+
+    Limited infections first infect entire components then infect
+    classes, starting with coaches and their students (ignoring
+    transitivity and "is coached by" relationships). If a limited infection
+    exists between the minimum and maximum number of users (inclusive), 
+    it will be performed.
+    
+    Returns True if the infection was successful, False otherwise.
+    """
+
+    users = plan_limited_infection(coaching_graph, min_users, max_users)
+    if users is not None:
+        apply_infection(users, feature)
         return True
 
     return False
@@ -186,22 +365,383 @@ def exact_subset_sum(sizes, target, i, n, subtotal):
 
     return False
 
-def exact_limited_infection(coaching_graph, feature, num_users):
-    """Infect a specified number of users exactly in a coaching graph."""
-    components = coaching_graph.all_connected_components()
+# Outcomes of anytime_subset_sum
+EXACT = "exact"             # The target was reached exactly
+INFEASIBLE = "infeasible"   # Every subset was tried without reaching it
+TIMEOUT = "timeout"         # The deadline passed first
+CANCELLED = "cancelled"     # The search was cancelled first
+
+class SearchStopped(Exception):
+    """An exact search stopped at its deadline or by cancellation.
+
+    status is TIMEOUT or CANCELLED, and users are the closest infection
+    found before stopping.
+    """
+
+    def __init__(self, status, users):
+        super(SearchStopped, self).__init__(
+                "Exact search stopped early: %s" % status)
+        self.status = status
+        self.users = users
+
+CHECK_STEPS = 1024          # Subsets tried between deadline checks
+PROGRESS_INTERVAL = 1.0     # Seconds between progress reports
+
+def anytime_subset_sum(sizes, target, deadline=None, progress=None,
+        cancel=None):
+    """Solve the subset sum problem iteratively, stopping early if asked.
+
+    Subsets are tried in the same order as exact_subset_sum, but without
+    recursion, keeping the subset whose total is closest to target (the
+    smaller, on ties). The search stops at deadline, a time.time() value,
+    or once cancel, a threading.Event, is set from another thread.
+    progress is called with the number of subsets tried, the closest
+    total and the elapsed seconds about once every PROGRESS_INTERVAL.
+
+    Returns (status, indices) where status is EXACT, INFEASIBLE, TIMEOUT
+    or CANCELLED, and indices are the closest subset found.
+    """
+
+    start = time.time()
+    last_report = start
+    n = len(sizes)
+    chosen = []
+    subtotal = 0
+    best = []
+    best_total = 0
+    steps = 0
+    if target == 0:
+        return EXACT, best
+
+    j = 0
+    while True:
+        if j < n:
+            steps += 1
+            if steps % CHECK_STEPS == 0:
+                now = time.time()
+                if cancel is not None and cancel.is_set():
+                    return CANCELLED, best
+                if deadline is not None and now >= deadline:
+                    return TIMEOUT, best
+                if progress is not None and (
+                        now - last_report >= PROGRESS_INTERVAL):
+                    progress(steps, best_total, now - start)
+                    last_report = now
+
+            total = subtotal + sizes[j]
+            if total == target:
+                return EXACT, chosen + [j]
+            if (abs(total - target), total) < (abs(best_total - target),
+                    best_total):
+                best = chosen + [j]
+                best_total = total
+            if total < target:
+                # Extend this subset with later sizes.
+                chosen.append(j)
+                subtotal = total
+            j += 1
+        elif len(chosen) > 0:
+            # Backtrack, replacing the last size chosen with the next one.
+            j = chosen.pop()
+            subtotal -= sizes[j]
+            j += 1
+        else:
+            return INFEASIBLE, best
+
+def plan_anytime_exact_infection(coaching_graph, num_users, time_budget=None,
+        progress=None, cancel=None):
+    """Plan an infection of exactly num_users users in whole components,
+    giving up after time_budget seconds or when cancel is set.
+
+    Returns (status, users) as in anytime_subset_sum, where users is a
+    frozenset of the users in the closest infection found. Complete
+    searches are memoized in plan_cache for each version of the coaching
+    graph.
+    """
+
+    key = plan_cache.key(coaching_graph, "exact", num_users)
+    found, plan = plan_cache.get(key)
+    if found:
+        return plan
+
+    deadline = None
+    if time_budget is not None:
+        deadline = time.time() + time_budget
+
+    components = cached_components(coaching_graph)
     sizes = [len(x) for x in components]
-    solution = exact_subset_sum(sizes, num_users, -1, len(sizes), 0)
-    if solution != False:
-        for i in solution:
-            for user in components[i]:
-                user.update_feature(feature)
-        return True
+    status, solution = anytime_subset_sum(sizes, num_users, deadline,
+            progress, cancel)
+    users = set()
+    for i in solution:
+        users.update(components[i])
+    plan = (status, frozenset(users))
+
+    if status == EXACT or status == INFEASIBLE:
+        plan_cache.put(key, plan)
+    return plan
+
+def plan_exact_infection(coaching_graph, num_users, time_budget=None,
+        progress=None, cancel=None, best_effort=False):
+    """Plan an infection of exactly num_users users in whole components.
+
+    The search stops after time_budget seconds or when cancel is set, and
+    reports progress as plan_anytime_exact_infection does.
+
+    Returns a frozenset of users to infect, or None if that is not
+    possible. Raises SearchStopped if the search stopped before finding
+    out. With best_effort, the closest infection found is returned
+    instead of None or raising. Plans are memoized in plan_cache for
+    each version of the coaching graph.
+    """
+
+    status, users = plan_anytime_exact_infection(coaching_graph, num_users,
+            time_budget, progress, cancel)
+    if status == EXACT or best_effort:
+        return users
+    elif status == INFEASIBLE:
+        return None
+
+    raise SearchStopped(status, users)
+
+def exact_limited_infection(coaching_graph, feature, num_users,
+        time_budget=None, progress=None, cancel=None, best_effort=False):
+    """Infect a specified number of users exactly in a coaching graph.
+
+    The options are those of plan_exact_infection. With best_effort, the
+    closest infection found is applied even if it isn't exact.
+
+    Returns True if exactly num_users users were infected, False
+    otherwise. Raises SearchStopped if the search stopped before finding
+    out, without infecting anyone.
+    """
+    users = plan_exact_infection(coaching_graph, num_users, time_budget,
+            progress, cancel, best_effort)
+    if users is not None:
+        apply_infection(users, feature)
+        return len(users) == num_users
     else:
         return False
 
+def print_progress(steps, best_total, elapsed):
+    """Report the progress of an exact infection on standard error."""
+    sys.stderr.write("%.0fs: tried %d combinations, closest is %d users\n" %
+            (elapsed, steps, best_total))
+
+def coaching_subtrees(coaching_graph):
+    """Return the coaching sub-hierarchies of a coaching graph and their sizes.
+
+    A post-order depth first search starts from each user who isn't
+    coached by anyone (and then from any user left over, in case of
+    coaching cycles). Each student joins the sub-hierarchy of the first
+    coach that reaches them, so students shared by several coaches are
+    counted once, and the sub-hierarchies form a forest.
+
+    Returns (roots, children, sizes). roots are the users at the top of
+    each tree, children maps users to the students in their
+    sub-hierarchy, and sizes maps users to the number of users in their
+    sub-hierarchy, themselves included.
+    """
+
+    tops = [x for x in coaching_graph.nodes() if len(x.is_coached_by()) == 0]
+    roots = []
+    children = dict()
+    sizes = dict()
+    for start in tops + coaching_graph.nodes():
+        if start in children:
+            continue
+        roots.append(start)
+        children[start] = []
+        stack = [(start, iter(start.coaches()))]
+        while len(stack) > 0:
+            user, students = stack[-1]
+            for student in students:
+                if student not in children:
+                    children[user].append(student)
+                    children[student] = []
+                    stack.append((student, iter(student.coaches())))
+                    break
+            else:
+                # All students are done, so the sub-hierarchy is too.
+                stack.pop()
+                sizes[user] = 1 + sum(sizes[x] for x in children[user])
+
+    return roots, children, sizes
+
+def cached_subtrees(coaching_graph):
+    """Return coaching_subtrees of coaching_graph, memoized in
+    structure_cache.
+    """
+    key = structure_cache.key(coaching_graph, "subtrees")
+    found, subtrees = structure_cache.get(key)
+    if not found:
+        subtrees = coaching_subtrees(coaching_graph)
+        structure_cache.put(key, subtrees)
+
+    return subtrees
+
+def plan_subtree_infection(coaching_graph, min_users, max_users):
+    """Plan an infection of whole coaching sub-hierarchies.
+
+    Starting with the largest hierarchies, each sub-hierarchy that fits
+    within max_users is infected whole. Sub-hierarchies that don't fit
+    are split into their students' sub-hierarchies, leaving their coach
+    out. Sizes are looked up rather than counted, so each user is looked
+    at no more than once.
+
+    Returns a frozenset of users to infect, or None if fewer than
+    min_users could be infected.
+    """
+
+    key = plan_cache.key(coaching_graph, "subtree", min_users, max_users)
+    found, users = plan_cache.get(key)
+    if found:
+        return users
+
+    roots, children, sizes = cached_subtrees(coaching_graph)
+    by_size = lambda x : sizes[x]
+    users = set()
+    stack = sorted(roots, key=by_size) # Largest on top
+    while len(stack) > 0 and len(users) < max_users:
+        user = stack.pop()
+        if len(users) + sizes[user] <= max_users:
+            subtree = [user]
+            while len(subtree) > 0:
+                member = subtree.pop()
+                users.add(member)
+                subtree.extend(children[member])
+        else:
+            stack.extend(sorted(children[user], key=by_size))
+
+    if len(users) >= min_users:
+        users = frozenset(users)
+    else:
+        users = None
+
+    plan_cache.put(key, users)
+    return users
+
+def subtree_infection(coaching_graph, feature, min_users, max_users):
+    """Perform an infection of whole coaching sub-hierarchies, between
+    minimum and maximum users.
+
+    Returns True if the infection was successful, False otherwise.
+    """
+    users = plan_subtree_infection(coaching_graph, min_users, max_users)
+    if users is not None:
+        apply_infection(users, feature)
+        return True
+
+    return False
+
+#------------------------------------------------------------------------------
+# Infection plan caching
+#------------------------------------------------------------------------------
+class PlanCache(object):
+    """A bounded, least recently used cache of infection plans.
+
+    Keys start with the fingerprint of the coaching graph that was
+    planned on. When a graph is seen with a new version, plans for its
+    older versions are dropped, so mutating a graph invalidates them.
+    Keys made with key() also drop the graph's plans once the graph is
+    garbage collected.
+    """
+
+    def __init__(self, maxsize=128):
+        self._plans = OrderedDict()
+        self._versions = dict()
+        self._graphs = dict() # Weak references to graphs, by uid
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._plans)
+
+    def key(self, coaching_graph, *parts):
+        """Return a key for parts of a plan of coaching_graph, and forget
+        the graph's plans when it is garbage collected.
+        """
+        fingerprint = coaching_graph.fingerprint()
+        uid = fingerprint[0]
+        if uid not in self._graphs:
+            self._graphs[uid] = weakref.ref(coaching_graph,
+                    lambda ref : self.forget(uid))
+        return (fingerprint,) + parts
+
+    def forget(self, uid):
+        """Drop every plan for the graph with uid."""
+        for key in self._plans.keys():
+            if key[0][0] == uid:
+                del self._plans[key]
+        self._versions.pop(uid, None)
+        self._graphs.pop(uid, None)
+
+    def _invalidate(self, fingerprint):
+        """Drop plans for older versions of the graph with fingerprint."""
+        uid, version = fingerprint
+        if self._versions.get(uid, version) != version:
+            for key in self._plans.keys():
+                if key[0][0] == uid:
+                    del self._plans[key]
+        self._versions[uid] = version
+
+    def get(self, key):
+        """Return a (found, plan) pair, marking the plan most recently used."""
+        self._invalidate(key[0])
+        if key not in self._plans:
+            self.misses += 1
+            return False, None
+
+        plan = self._plans.pop(key)
+        self._plans[key] = plan
+        self.hits += 1
+        return True, plan
+
+    def put(self, key, plan):
+        """Cache plan for key, evicting the least recently used plan."""
+        self._invalidate(key[0])
+        self._plans.pop(key, None)
+        self._plans[key] = plan
+        while len(self._plans) > self.maxsize:
+            self._plans.popitem(last=False)
+
+    def clear(self):
+        """Drop all plans and reset the hit and miss counters."""
+        self._plans.clear()
+        self._versions.clear()
+        self._graphs.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return a dictionary of hits, misses and cached plans."""
+        return {"hits" : self.hits, "misses" : self.misses,
+                "size" : len(self._plans), "maxsize" : self.maxsize}
+
+def cached_components(coaching_graph):
+    """Return the connected components of coaching_graph, memoized in
+    structure_cache so overlapping queries share one traversal of the
+    graph.
+    """
+    key = structure_cache.key(coaching_graph, "components")
+    found, components = structure_cache.get(key)
+    if not found:
+        components = coaching_graph.all_connected_components()
+        structure_cache.put(key, components)
+
+    return components
+
+plan_cache = PlanCache() # Shared by the planning functions above
+structure_cache = PlanCache() # Components and subtrees the plans use
+
 #------------------------------------------------------------------------------
 # Input output functions
 #------------------------------------------------------------------------------
+CSV_BUFFER_SIZE = 1024 * 1024 # Bytes read at a time from edge list files
+EDGE_LIST_HEADER = ["coach_id", "student_id"]   # Optional first rows
+FEATURES_HEADER = ["user_id", "feature"]
+
 def json_file_to_coaching_graph(graph_file):
     """Convert JSON encoded graph to a coaching graph."""
     graph_data = json.load( open(graph_file) )
@@ -230,6 +770,87 @@ def json_file_to_coaching_graph(graph_file):
 
     return coaching_graph
 
+def edge_list_file_to_coaching_graph(edges_file, users_file=None,
+        features_file=None):
+    """Convert CSV edge list files to a coaching graph.
+
+    edges_file has one coach_id,student_id pair per line. The optional
+    users_file lists user ids one per line, which is only needed for
+    users without coaching relationships, and the optional features_file
+    has one user_id,feature pair per line. Either CSV file may start with
+    a coach_id,student_id or user_id,feature header row.
+
+    Files are read through large buffers with the csv module, and users
+    are created directly as ids are first seen, rather than looked up in
+    the graph for every relationship. The cyclic garbage collector is
+    paused while loading. Every user and set created is kept, so its
+    passes over the growing graph would find nothing to collect, yet
+    they cost most of the loading time.
+    """
+    users = dict()
+
+    def find_user(user_id):
+        """Return the user with user_id, creating them if needed."""
+        user = users.get(user_id)
+        if user is None:
+            user = users[user_id] = User(intern(user_id))
+        return user
+
+    def read_rows(f, header):
+        """Generate the rows of a CSV file, skipping a header row."""
+        rows = csv.reader(f)
+        for row in rows:
+            if [x.strip() for x in row[:len(header)]] != header:
+                yield row
+            break
+        for row in rows:
+            yield row
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if users_file is not None:
+            with open(users_file, "rb", CSV_BUFFER_SIZE) as f:
+                for line in f:
+                    user_id = line.strip()
+                    if user_id:
+                        find_user(user_id)
+
+        # Add coaching relationships. This is the bulk of the work, so
+        # lookups are done inline rather than through find_user.
+        with open(edges_file, "rb", CSV_BUFFER_SIZE) as f:
+            get_user = users.get
+            for row in read_rows(f, EDGE_LIST_HEADER):
+                if len(row) < 2:
+                    continue
+                coach_id = row[0].strip()
+                student_id = row[1].strip()
+                coach = get_user(coach_id)
+                if coach is None:
+                    coach = users[coach_id] = User(intern(coach_id))
+                student = get_user(student_id)
+                if student is None:
+                    student = users[student_id] = User(intern(student_id))
+                coach.outgoing().add(student)
+                student.incoming().add(coach)
+
+        # Add features to users if available
+        if features_file is not None:
+            with open(features_file, "rb", CSV_BUFFER_SIZE) as f:
+                for row in read_rows(f, FEATURES_HEADER):
+                    if len(row) >= 2:
+                        find_user(row[0].strip()).add_feature(
+                                intern(row[1].strip()))
+
+        coaching_graph = graph.Graph(directed=True)
+        for user in users.itervalues():
+            coaching_graph.add_node(user)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return coaching_graph
+
 def coaching_graph_to_json_file(coaching_graph, graph_file):
     """Convert a coaching graph to a JSON file."""
 
@@ -253,29 +874,339 @@ def coaching_graph_to_json_file(coaching_graph, graph_file):
     # Output to a file
     json.dump(output, open(graph_file, "w"), indent=4)
 
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS coaches (
+    coach_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    PRIMARY KEY (coach_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS coaches_student ON coaches (student_id);
+CREATE TABLE IF NOT EXISTS user_features (
+    user_id TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    PRIMARY KEY (user_id, feature)
+);
+CREATE INDEX IF NOT EXISTS user_features_feature ON user_features (feature);
+"""
+
+def open_sqlite_store(db_file, create=False):
+    """Open a SQLite coaching graph store.
+
+    With create, the store and its tables are created if needed.
+    Otherwise the store must already exist, and IOError is raised if it
+    doesn't, rather than quietly creating an empty one.
+    """
+    if not create and not os.path.exists(db_file):
+        raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), db_file)
+
+    connection = sqlite3.connect(db_file)
+    connection.text_factory = str
+    if create:
+        connection.executescript(SQLITE_SCHEMA)
+    return connection
+
+def sqlite_file_to_coaching_graph(db_file):
+    """Convert a SQLite coaching graph store to a coaching graph.
+
+    Each table is read with a single query.
+    """
+    connection = open_sqlite_store(db_file)
+    try:
+        users = dict()
+        for (user_id,) in connection.execute("SELECT id FROM users"):
+            users[user_id] = User(user_id)
+
+        # Add coaching relationships
+        for coach_id, student_id in connection.execute(
+                "SELECT coach_id, student_id FROM coaches"):
+            coach = users[coach_id]
+            student = users[student_id]
+            coach.outgoing().add(student)
+            student.incoming().add(coach)
+
+        # Add features to users
+        for user_id, feature in connection.execute(
+                "SELECT user_id, feature FROM user_features"):
+            users[user_id].add_feature(feature)
+    finally:
+        connection.close()
+
+    coaching_graph = graph.Graph(directed=True)
+    for user in users.itervalues():
+        coaching_graph.add_node(user)
+
+    return coaching_graph
+
+def coaching_graph_to_sqlite_file(coaching_graph, db_file):
+    """Replace the contents of a SQLite coaching graph store with a graph,
+    creating the store if needed.
+    """
+    connection = open_sqlite_store(db_file, create=True)
+    try:
+        with connection:
+            connection.execute("DELETE FROM user_features")
+            connection.execute("DELETE FROM coaches")
+            connection.execute("DELETE FROM users")
+            connection.executemany("INSERT INTO users (id) VALUES (?)",
+                    ((x.id(),) for x in coaching_graph.nodes()))
+            connection.executemany(
+                    "INSERT INTO coaches (coach_id, student_id) VALUES (?, ?)",
+                    ((x.id(), y.id()) for x in coaching_graph.all_parents()
+                        for y in x.coaches()))
+            connection.executemany(
+                    "INSERT INTO user_features (user_id, feature) "
+                    "VALUES (?, ?)",
+                    ((x.id(), y) for x in coaching_graph.nodes()
+                        for y in x.features()))
+    finally:
+        connection.close()
+
+def save_infection_to_sqlite_file(users, feature, db_file):
+    """Record an infection of users with feature in a SQLite store.
+
+    Only the rows of the infected users are written, in a single
+    transaction, to a store that must already hold the graph. As with
+    update_feature, a feature starting with ! is discarded instead.
+    """
+    if feature.startswith("!"):
+        statement = ("DELETE FROM user_features "
+                "WHERE user_id = ? AND feature = ?")
+        feature = feature[1:]
+    else:
+        statement = ("INSERT OR IGNORE INTO user_features (user_id, feature) "
+                "VALUES (?, ?)")
+
+    connection = open_sqlite_store(db_file)
+    try:
+        with connection:
+            connection.executemany(statement,
+                    ((x.id(), feature) for x in users))
+    finally:
+        connection.close()
+
+JOURNAL_CHUNK_SIZE = 4096    # Bytes read at a time looking for a torn entry
+
+def append_to_journal(journal_file, feature, users, timestamp=None):
+    """Append an infection of users with feature to a rollout journal.
+
+    Each infection is a line of JSON with the feature, the infected user
+    ids and a timestamp (now, by default). The line is flushed and
+    fsync'd before returning, so a recorded infection survives a crash.
+    The journal is locked while appending, so concurrent appends and
+    compactions wait for each other.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    entry = json.dumps({"feature" : feature,
+        "users" : [x.id() for x in users],
+        "timestamp" : timestamp})
+
+    created = not os.path.exists(journal_file)
+    with open(journal_file, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX) # Released when f is closed
+        truncate_torn_entry(f)
+        f.write(entry + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    if created:
+        # Make sure the new journal's directory entry is on disk too.
+        fsync_directory(journal_file)
+
+def fsync_directory(path):
+    """Flush the directory entry of path to disk."""
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+def truncate_torn_entry(f):
+    """Cut a journal opened for appending back to its last newline.
+
+    A crash in the middle of an append leaves a last line without a
+    newline. Appending after it would glue the next entry onto the torn
+    one, leaving a complete line that isn't valid JSON.
+    """
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    position = end
+    while position > 0:
+        start = max(position - JOURNAL_CHUNK_SIZE, 0)
+        f.seek(start)
+        chunk = f.read(position - start)
+        newline = chunk.rfind("\n")
+        if newline >= 0:
+            position = start + newline + 1
+            break
+        position = start
+
+    if position < end:
+        f.truncate(position)
+    f.seek(0, os.SEEK_END)
+
+def read_journal(journal_file):
+    """Return the (feature, user ids, timestamp) entries of a journal.
+
+    A last line without a newline was cut short by a crash while it was
+    being appended, and is ignored.
+    """
+    entries = []
+    if not os.path.exists(journal_file):
+        return entries
+
+    with open(journal_file, "rb") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            entry = json.loads(line)
+            entries.append((entry["feature"], entry["users"],
+                entry["timestamp"]))
+
+    return entries
+
+def replay_journal(coaching_graph, journal_file):
+    """Apply the infections recorded in a journal to a coaching graph.
+
+    Replaying is idempotent: each user's features end up as the last
+    entry touching them left them, so replaying a journal that was
+    already folded into the graph changes nothing.
+
+    Returns the number of infections replayed.
+    """
+    entries = read_journal(journal_file)
+    for feature, user_ids, timestamp in entries:
+        for user_id in user_ids:
+            coaching_graph.find_node(user_id).update_feature(feature)
+
+    return len(entries)
+
+def compact_journal(snapshot_file, journal_file, new_snapshot_file=None):
+    """Fold a journal into a new JSON snapshot of the coaching graph.
+
+    The new snapshot (replacing snapshot_file by default) is written to a
+    temporary file, fsync'd and renamed into place, so a crash leaves
+    either the old or the new snapshot. The journal is emptied
+    afterwards. A crash before that only means the journal is replayed
+    again on the new snapshot, which changes nothing. The journal is
+    locked from reading it until it is emptied, so no infection can be
+    appended in between and lost.
+
+    Returns the number of infections folded in.
+    """
+    if new_snapshot_file is None:
+        new_snapshot_file = snapshot_file
+
+    with open(journal_file, "a+b") as journal:
+        fcntl.flock(journal, fcntl.LOCK_EX) # Released when closed
+        coaching_graph = json_file_to_coaching_graph(snapshot_file)
+        num_entries = replay_journal(coaching_graph, journal_file)
+
+        temp_file = new_snapshot_file + ".tmp"
+        coaching_graph_to_json_file(coaching_graph, temp_file)
+        with open(temp_file, "rb") as f:
+            os.fsync(f.fileno())
+        os.rename(temp_file, new_snapshot_file)
+        # The rename must be on disk before the journal is emptied, or a
+        # crash could keep the empty journal and lose the new snapshot.
+        fsync_directory(new_snapshot_file)
+
+        journal.truncate(0)
+        journal.flush()
+        os.fsync(journal.fileno())
+
+    return num_entries
+
 def print_user_features(coaching_graph):
     """Print the features each user of coaching_graph has"""
 
     for user in coaching_graph.nodes():
         print "User %s has features %s" % (user.id(), user.features())
 
+def print_feature_report(coaching_graph, feature_index, feature):
+    """Print how many users have each feature, and how much of each
+    component has feature.
+    """
+
+    num_users = len(coaching_graph.nodes())
+    for name in sorted(feature_index.features()):
+        count = feature_index.count(name)
+        print "Feature %s: %d of %d users (%.1f%%)" % (name, count,
+                num_users, 100.0 * count / num_users)
+
+    coverage = feature_index.component_coverage(feature,
+            cached_components(coaching_graph))
+    full = len([x for x in coverage if x[0] == x[1]])
+    none = len([x for x in coverage if x[0] == 0])
+    print "Components with %s: %d fully, %d partially, %d not at all" % (
+            feature, full, len(coverage) - full - none, none)
+    for infected, size in sorted(coverage, key=lambda x : -x[1]):
+        if 0 < infected < size:
+            print "  %d of %d users (%.1f%%)" % (infected, size,
+                    100.0 * infected / size)
+
 def main(args):
     """Main script to execute"""
 
-    coaching_graph = json_file_to_coaching_graph(args.infilename)
+    if args.format == "csv":
+        coaching_graph = edge_list_file_to_coaching_graph(args.infilename,
+                args.users, args.features)
+    elif args.format == "sqlite":
+        coaching_graph = sqlite_file_to_coaching_graph(args.infilename)
+    else:
+        coaching_graph = json_file_to_coaching_graph(args.infilename)
+
+    if args.journal:
+        replay_journal(coaching_graph, args.journal)
 
+    if args.report:
+        feature_index = FeatureIndex(coaching_graph)
+
+    users = None
     if args.total_infection:
-        total_infection(coaching_graph, args.feature, args.total_infection)
+        users = coaching_graph.connected_component(args.total_infection)
 
     if args.limited_infection:
-        limited_infection(coaching_graph, args.feature, 
+        users = plan_limited_infection(coaching_graph,
                 args.limited_infection[0], args.limited_infection[1])
 
     if args.exact_infection:
-        exact_limited_infection(coaching_graph, args.feature, 
-                args.exact_infection)
+        progress = print_progress if args.progress else None
+        status, users = plan_anytime_exact_infection(coaching_graph,
+                args.exact_infection, args.time_budget, progress)
+        print "Exact infection of %d users: %s, closest is %d users" % (
+                args.exact_infection, status, len(users))
+        if status != EXACT and not args.best_effort:
+            users = None
+
+    if args.subtree_infection:
+        users = plan_subtree_infection(coaching_graph,
+                args.subtree_infection[0], args.subtree_infection[1])
 
-    coaching_graph_to_json_file(coaching_graph, args.outfilename)
+    if users is not None:
+        apply_infection(users, args.feature)
+
+    if args.report:
+        print_feature_report(coaching_graph, feature_index, args.feature)
+
+    if args.journal:
+        # Record only the infection, leaving the graph files alone.
+        if users is not None:
+            append_to_journal(args.journal, args.feature, users)
+    elif args.format == "sqlite":
+        # Only write the infected users to a store that already has
+        # the graph.
+        if not (os.path.exists(args.outfilename) and
+                os.path.samefile(args.infilename, args.outfilename)):
+            coaching_graph_to_sqlite_file(coaching_graph, args.outfilename)
+        elif users is not None:
+            save_infection_to_sqlite_file(users, args.feature,
+                    args.outfilename)
+    else:
+        coaching_graph_to_json_file(coaching_graph, args.outfilename)
 
 #------------------------------------------------------------------------------
 # Main script
@@ -287,7 +1218,40 @@ if __name__ == "__main__":
     parser.add_argument('infilename',  
             help="input file containing coaching graph")
     parser.add_argument('outfilename',
-            help="output file containing infected graph")
+            nargs='?',
+            help="output file containing infected graph, not needed "
+                 "with --journal")
+    parser.add_argument("-j", "--journal",
+            metavar='FILE',
+            help="replay the rollout journal FILE over the input graph, "
+                 "and append the infection to it instead of writing "
+                 "an output file")
+    parser.add_argument("-f", "--format",
+            choices=["json", "csv", "sqlite"],
+            default="json",
+            help="graph format, JSON, a CSV edge list of "
+                 "coach_id,student_id pairs (input only) or a SQLite "
+                 "store (default %(default)s)")
+    parser.add_argument("--users",
+            metavar='FILE',
+            help="with CSV input, a file of user ids, one per line")
+    parser.add_argument("--features",
+            metavar='FILE',
+            help="with CSV input, a CSV file of user_id,feature pairs")
+    parser.add_argument("-r", "--report",
+            action="store_true",
+            help="print feature coverage of users and components")
+    parser.add_argument("--time-budget",
+            type=float,
+            metavar='SECONDS',
+            help="with -e, stop searching after SECONDS")
+    parser.add_argument("--progress",
+            action="store_true",
+            help="with -e, report progress on standard error")
+    parser.add_argument("--best-effort",
+            action="store_true",
+            help="with -e, infect the closest number of users found if "
+                 "the exact number isn't")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-e", "--exact-infection", 
             type=int,
@@ -297,9 +1261,16 @@ if __name__ == "__main__":
             type=int,
             metavar=('MIN', 'MAX'),
             help="infect MIN to MAX users if possible")
+    group.add_argument("-s", "--subtree-infection", nargs=2,
+            type=int,
+            metavar=('MIN', 'MAX'),
+            help="infect MIN to MAX users in whole coaching "
+                 "sub-hierarchies if possible")
     group.add_argument("-t", "--total-infection", 
             metavar='USER',
             help="totally infect the component containing USER")
     args = parser.parse_args()
+    if args.outfilename is None and args.journal is None:
+        parser.error("an output file or --journal is required")
 
     main(args)
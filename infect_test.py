@@ -14,6 +14,18 @@ __version__ = '1'
 #------------------------------------------------------------------------------
 import graph
 import infect
+import memprofile
+import outofcore
+import portfolio
+import replan
+import fcntl
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 #------------------------------------------------------------------------------
@@ -116,6 +128,130 @@ class TestInfectFunctions(unittest.TestCase):
         nodeB = self.graph1.find_node("B")
         self.assertEqual(nodeB.is_coached_by(), set([nodeA]))
 
+    def test_load_edge_list(self):
+        """Test graph loading from CSV edge lists"""
+        workdir = tempfile.mkdtemp()
+        try:
+            edges = os.path.join(workdir, "edges.csv")
+            users = os.path.join(workdir, "users.txt")
+            features = os.path.join(workdir, "features.csv")
+            with open(edges, "w") as f:
+                f.write("coach_id, student_id\n")
+                for coach in self.graph3.all_parents():
+                    for student in coach.coaches():
+                        f.write("%s,%s\n" % (coach.id(), student.id()))
+            with open(users, "w") as f:
+                f.write("A\nZ\n")
+            with open(features, "w") as f:
+                f.write("user_id,feature\nZ,lonely\nA,coach\n")
+
+            graph4 = infect.edge_list_file_to_coaching_graph(edges, users,
+                    features)
+        finally:
+            shutil.rmtree(workdir)
+
+        self.assertEqual(len(graph4.nodes()), 14)
+        self.assertEqual(len(graph4.find_node("A").coaches()), 3)
+        self.assertEqual(len(graph4.find_node("K").is_coached_by()), 1)
+        self.assertTrue(graph4.find_node("Z").is_singleton())
+        self.assertEqual(graph4.find_node("Z").features(), set(["lonely"]))
+        self.assertEqual(graph4.find_node("A").features(), set(["coach"]))
+        self.assertEqual(len(graph4.all_connected_components()), 3)
+        self.assertTrue(gc.isenabled())
+
+    def test_sqlite_store(self):
+        """Test saving and loading graphs and infections with SQLite"""
+        workdir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(workdir, "graph3.db")
+            self.assertRaises(IOError, infect.sqlite_file_to_coaching_graph,
+                    db_file)
+            self.assertFalse(os.path.exists(db_file))
+
+            self.graph3.find_node("A").add_feature("old")
+            infect.coaching_graph_to_sqlite_file(self.graph3, db_file)
+            graph4 = infect.sqlite_file_to_coaching_graph(db_file)
+            self.assertEqual(len(graph4.nodes()), 13)
+            self.assertEqual(len(graph4.find_node("A").coaches()), 3)
+            self.assertEqual(graph4.find_node("A").features(), set(["old"]))
+
+            users = infect.plan_exact_infection(graph4, 4)
+            infect.save_infection_to_sqlite_file(users, "new", db_file)
+            infect.save_infection_to_sqlite_file(
+                    [graph4.find_node("A")], "!old", db_file)
+            connection = infect.open_sqlite_store(db_file)
+            rows = connection.execute(
+                    "SELECT user_id, feature FROM user_features").fetchall()
+            connection.close()
+            self.assertEqual(sorted(rows), [("J", "new"), ("K", "new"),
+                ("L", "new"), ("M", "new")])
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_journal(self):
+        """Test rollout journals and their compaction"""
+        workdir = tempfile.mkdtemp()
+        try:
+            snapshot = os.path.join(workdir, "graph3.json")
+            journal = os.path.join(workdir, "journal.log")
+            shutil.copy("graphs/graph3.json", snapshot)
+
+            small = self.graph3.connected_component("J")
+            infect.append_to_journal(journal, "small", small, 1.0)
+            infect.append_to_journal(journal, "!small",
+                    [self.graph3.find_node("K")], 2.0)
+            with open(journal, "ab") as f:
+                f.write('{"feature": "torn", "us') # Crashed mid-append
+
+            entries = infect.read_journal(journal)
+            self.assertEqual(len(entries), 2)
+            self.assertEqual(entries[1], ("!small", ["K"], 2.0))
+
+            # Appending after a torn entry drops it rather than gluing on.
+            infect.append_to_journal(journal, "other",
+                    [self.graph3.find_node("A")], 3.0)
+            entries = infect.read_journal(journal)
+            self.assertEqual(len(entries), 3)
+            self.assertEqual(entries[2], ("other", ["A"], 3.0))
+
+            graph4 = infect.json_file_to_coaching_graph(snapshot)
+            self.assertEqual(infect.replay_journal(graph4, journal), 3)
+            infected = set(x.id() for x in graph4.nodes()
+                    if "small" in x.features())
+            self.assertEqual(infected, set("JLM"))
+
+            self.assertEqual(infect.compact_journal(snapshot, journal), 3)
+            self.assertEqual(os.path.getsize(journal), 0)
+            graph5 = infect.json_file_to_coaching_graph(snapshot)
+            infected = set(x.id() for x in graph5.nodes()
+                    if "small" in x.features())
+            self.assertEqual(infected, set("JLM"))
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_journal_lock(self):
+        """Test appends wait for a journal locked by another writer"""
+        workdir = tempfile.mkdtemp()
+        try:
+            journal = os.path.join(workdir, "journal.log")
+            with open(journal, "a+b") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.write('{"feature": "slow", "us') # Still being written
+                f.flush()
+                writer = threading.Thread(target=infect.append_to_journal,
+                        args=(journal, "other",
+                            [self.graph3.find_node("A")], 1.0))
+                writer.start()
+                writer.join(0.2)
+                self.assertTrue(writer.is_alive()) # Waiting for the lock
+                f.write('ers": ["J"], "timestamp": 0.0}\n')
+            writer.join()
+
+            self.assertEqual(infect.read_journal(journal),
+                    [("slow", ["J"], 0.0), ("other", ["A"], 1.0)])
+        finally:
+            shutil.rmtree(workdir)
+
     def test_feature_update(self):
         """Test the update_feature. Also tests add_feature/disable_feature"""
 
@@ -126,6 +262,32 @@ class TestInfectFunctions(unittest.TestCase):
         nodeA.update_feature("!test_feature")
         self.assertTrue("test_feature" not in nodeA.features())
 
+    def test_feature_index(self):
+        """Test the inverted feature index follows feature updates"""
+
+        index = infect.FeatureIndex(self.graph3)
+        self.assertEqual(index.count("small"), 0)
+
+        infect.total_infection(self.graph3, "small", "J")
+        infect.total_infection(self.graph3, "all", "J")
+        infect.total_infection(self.graph3, "all", "A")
+        self.assertEqual(index.count("small"), 4)
+        self.assertEqual(index.count("all"), 13)
+        self.assertEqual(len(index.users_with_without("all", "small")), 9)
+
+        self.graph3.find_node("K").update_feature("!small")
+        self.assertEqual(index.count("small"), 3)
+        self.assertEqual(sorted(index.component_coverage("small",
+            self.graph3.all_connected_components())), [(0, 9), (3, 4)])
+
+        infect.total_infection(self.graph3, "!small", "J")
+        self.assertEqual(sorted(index.features()), ["all"])
+
+        # Users of other graphs aren't indexed, and users carry nothing
+        infect.total_infection(self.graph1, "small", "A")
+        self.assertEqual(index.count("small"), 0)
+        self.assertEqual(len(vars(self.graph3.find_node("J"))), 5)
+
     def test_total_infection(self):
         """Test total_infection function"""
 
@@ -251,5 +413,432 @@ class TestInfectFunctions(unittest.TestCase):
         for node in self.graph3.nodes():
             self.assertTrue("exact6" in node.features())
 
+    def test_anytime_exact_infection(self):
+        """Test exact infections with deadlines and cancellation"""
+
+        status, users = infect.plan_anytime_exact_infection(self.graph3, 9)
+        self.assertEqual(status, infect.EXACT)
+        self.assertEqual(len(users), 9)
+
+        status, users = infect.plan_anytime_exact_infection(self.graph3, 6)
+        self.assertEqual(status, infect.INFEASIBLE)
+        self.assertEqual(len(users), 4) # Closest to 6
+
+        # Sizes that can never total an odd number take a very long time
+        sizes = [2] * 40
+        status, chosen = infect.anytime_subset_sum(sizes, 41,
+                deadline=time.time())
+        self.assertEqual(status, infect.TIMEOUT)
+        self.assertTrue(sum(sizes[i] for i in chosen) in [40, 42])
+
+        cancel = threading.Event()
+        cancel.set()
+        status, chosen = infect.anytime_subset_sum(sizes, 41, cancel=cancel)
+        self.assertEqual(status, infect.CANCELLED)
+
+        reports = []
+        interval = infect.PROGRESS_INTERVAL
+        infect.PROGRESS_INTERVAL = 0
+        try:
+            infect.anytime_subset_sum(sizes, 41, deadline=time.time() + 0.1,
+                    progress=lambda *x : reports.append(x))
+        finally:
+            infect.PROGRESS_INTERVAL = interval
+        self.assertTrue(len(reports) > 0)
+        self.assertEqual(reports[-1][1], 40)
+
+    def test_exact_infection_time_budget(self):
+        """Test the exact infection library functions stop when asked"""
+
+        # Forty pairs can never total an odd number of users
+        pairs = graph.Graph(directed=True)
+        for i in range(40):
+            pairs.add_edge(infect.User("c%d" % i), infect.User("s%d" % i))
+
+        try:
+            infect.exact_limited_infection(pairs, "odd", 41, time_budget=0.05)
+            self.fail("The search should have timed out")
+        except infect.SearchStopped as stopped:
+            self.assertEqual(stopped.status, infect.TIMEOUT)
+        self.assertFalse(any("odd" in x.features() for x in pairs.nodes()))
+
+        cancel = threading.Event()
+        cancel.set()
+        try:
+            infect.plan_exact_infection(pairs, 41, cancel=cancel)
+            self.fail("The search should have been cancelled")
+        except infect.SearchStopped as stopped:
+            self.assertEqual(stopped.status, infect.CANCELLED)
+
+        success = infect.exact_limited_infection(pairs, "odd", 41,
+                time_budget=0.05, best_effort=True)
+        self.assertFalse(success)
+        num_infected = len([x for x in pairs.nodes() if "odd" in x.features()])
+        self.assertTrue(num_infected in [40, 42])
+
+    def test_coaching_subtrees(self):
+        """Test precomputed coaching sub-hierarchy sizes"""
+
+        roots, children, sizes = infect.coaching_subtrees(self.graph2)
+        self.assertEqual(roots, [self.graph2.find_node("A")])
+        self.assertEqual(sizes[self.graph2.find_node("A")], 9)
+        self.assertEqual(sizes[self.graph2.find_node("B")], 6)
+        self.assertEqual(sizes[self.graph2.find_node("E")], 3)
+        self.assertEqual(sizes[self.graph2.find_node("H")], 1)
+
+        # Shared students are counted once, and cycles are fine.
+        self.graph2.add_edge(self.graph2.find_node("C"),
+                self.graph2.find_node("H"))
+        self.graph2.add_edge(self.graph2.find_node("I"),
+                self.graph2.find_node("A"))
+        roots, children, sizes = infect.coaching_subtrees(self.graph2)
+        self.assertEqual(len(roots), 1)
+        self.assertEqual(sizes[roots[0]], 9)
+
+    def test_subtree_infection(self):
+        """Test the subtree_infection function"""
+
+        success = infect.subtree_infection(self.graph2, "subtree1", 6, 6)
+        self.assertTrue(success)
+        infected = set(x.id() for x in self.graph2.nodes()
+                if "subtree1" in x.features())
+        self.assertEqual(infected, set("BEFGHI"))
+
+        success = infect.subtree_infection(self.graph2, "subtree2", 4, 5)
+        self.assertTrue(success)
+        infected = set(x.id() for x in self.graph2.nodes()
+                if "subtree2" in x.features())
+        self.assertEqual(infected, set("EFGHI"))
+
+        success = infect.subtree_infection(self.graph3, "subtree3", 10, 12)
+        self.assertTrue(success)
+        num_infected = len(filter(lambda x : "subtree3" in x.features(),
+            self.graph3.nodes()))
+        self.assertTrue(num_infected >= 10 and num_infected <= 12)
+
+    def test_approx_subset_sum(self):
+        """Test approx_subset_sum on component sizes"""
+
+        chosen = infect.approx_subset_sum([9, 4], 3, 5)
+        self.assertEqual(chosen, [1])
+
+        chosen = infect.approx_subset_sum([9, 4], 10, 13)
+        self.assertEqual(sorted(chosen), [0, 1])
+
+        chosen = infect.approx_subset_sum([9, 4], 1, 3)
+        self.assertEqual(chosen, [])
+
+        # Equal sizes are bundled, but each index is still chosen once
+        sizes = [3] * 10 + [5]
+        chosen = infect.approx_subset_sum(sizes, 17, 17)
+        self.assertEqual(len(set(chosen)), len(chosen))
+        self.assertEqual(sum(sizes[i] for i in chosen), 17)
+
+    def test_plan_cache(self):
+        """Test memoization of infection plans"""
+
+        infect.plan_cache.clear()
+        infect.structure_cache.clear()
+        plan1 = infect.plan_limited_infection(self.graph3, 3, 5)
+        misses = infect.plan_cache.misses
+        plan2 = infect.plan_limited_infection(self.graph3, 3, 5)
+        self.assertTrue(plan1 is plan2)
+        self.assertEqual(infect.plan_cache.misses, misses)
+        self.assertEqual(infect.plan_cache.hits, 1)
+
+        # Failures are memoized too
+        self.assertEqual(infect.plan_exact_infection(self.graph3, 6), None)
+        self.assertEqual(infect.plan_exact_infection(self.graph3, 6), None)
+        self.assertEqual(infect.plan_cache.hits, 2) # Plans only
+        self.assertEqual(len(infect.plan_cache), 2)
+
+        # Mutating the graph invalidates its plans
+        user = infect.User("N")
+        self.graph3.add_edge(self.graph3.find_node("J"), user)
+        plan3 = infect.plan_exact_infection(self.graph3, 5)
+        self.assertTrue(user in plan3)
+        self.assertEqual(len(infect.plan_cache), 1)
+
+        # Graphs that are no longer used take their plans with them
+        del self.graph3
+        gc.collect()
+        self.assertEqual(len(infect.plan_cache), 0)
+        self.assertEqual(len(infect.structure_cache), 0)
+        self.assertEqual(len(infect.plan_cache._versions), 0)
+
+    def test_plan_cache_eviction(self):
+        """Test least recently used eviction of plans"""
+
+        cache = infect.PlanCache(maxsize=2)
+        fingerprint = self.graph1.fingerprint()
+        cache.put((fingerprint, "exact", 1), None)
+        cache.put((fingerprint, "exact", 2), None)
+        cache.get((fingerprint, "exact", 1))
+        cache.put((fingerprint, "exact", 3), None)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.get((fingerprint, "exact", 1))[0])
+        self.assertFalse(cache.get((fingerprint, "exact", 2))[0])
+        self.assertEqual(cache.stats()["misses"], 1)
+
+
+class TestReplanFunctions(unittest.TestCase):
+    """Unit testing of incremental infections."""
+
+    def setUp(self):
+        """Start with the small component of graph3 infected"""
+        self.graph3 = infect.json_file_to_coaching_graph("graphs/graph3.json")
+        infect.total_infection(self.graph3, "f", "J")
+        self.rollout = replan.IncrementalInfection(self.graph3, "f")
+
+    def test_index(self):
+        """Test the initial component index"""
+        self.assertEqual(len(self.rollout), 4)
+        sets = graph.DisjointSets()
+        for x in "ABC":
+            sets.add(x)
+        sets.union("A", "B")
+        self.assertEqual(sets.size("B"), 2)
+        self.assertEqual(sets.find("A"), sets.find("B"))
+        self.assertEqual(len(sets.roots()), 2)
+
+    def test_extend_component(self):
+        """Test new students join an infected component"""
+        success = self.rollout.apply_delta([infect.User("N")], [("J", "N")],
+                4, 6)
+        self.assertTrue(success)
+        self.assertTrue("f" in self.graph3.find_node("N").features())
+        self.assertEqual(len(self.rollout), 5)
+
+    def test_merge_classes(self):
+        """Test merging components that can't be infected as a whole"""
+        success = self.rollout.apply_delta([], [("D", "K")], 1, 10)
+        self.assertTrue(success)
+        self.assertTrue("f" in self.graph3.find_node("D").features())
+        self.assertTrue("f" not in self.graph3.find_node("A").features())
+        self.assertEqual(len(self.rollout), 5)
+
+    def test_merge_cures(self):
+        """Test curing a component that can't be infected as a whole"""
+        success = self.rollout.apply_delta([], [("D", "K")], 0, 3)
+        self.assertTrue(success)
+        for node in self.graph3.nodes():
+            self.assertTrue("f" not in node.features())
+
+    def test_existing_users(self):
+        """Test users already in the graph are skipped, not reset"""
+        success = self.rollout.apply_delta([infect.User("J")], [], 4, 6)
+        self.assertTrue(success)
+        success = self.rollout.apply_delta([], [("D", "K")], 4, 6)
+        self.assertTrue(success)
+        # The merged component is too big to infect whole, so D's class
+        # is infected along with K.
+        root = self.rollout._sets.find("K")
+        self.assertEqual(self.rollout._counts, {root : 5})
+        self.assertEqual(self.rollout._whole, {root : False})
+        self.assertTrue("f" in self.graph3.find_node("D").features())
+
+    def test_edge_order(self):
+        """Test class repairs don't depend on the order of new edges"""
+        for edges in [[("N", "M"), ("P", "N")], [("P", "N"), ("N", "M")]]:
+            coaching_graph = graph.Graph(directed=True)
+            users = dict((x, infect.User(x)) for x in "PQR")
+            coaching_graph.add_edge(users["P"], users["Q"])
+            coaching_graph.add_edge(users["R"], users["Q"])
+            users["P"].add_feature("f")
+            users["Q"].add_feature("f")
+            rollout = replan.IncrementalInfection(coaching_graph, "f")
+
+            success = rollout.apply_delta([infect.User("N"),
+                infect.User("M")], edges, 1, 3)
+            self.assertFalse(success) # M can't join N's class
+            self.assertEqual(set(x.id() for x in rollout.infected),
+                    set("NPQ"))
+
+    def test_fill(self):
+        """Test new users are infected to reach the minimum"""
+        success = self.rollout.apply_delta([infect.User("N")], [], 5, 6)
+        self.assertTrue(success)
+        self.assertTrue("f" in self.graph3.find_node("N").features())
+
+        success = self.rollout.apply_delta([infect.User("O")], [], 8, 9)
+        self.assertFalse(success) # Still short of the minimum
+        self.assertEqual(len(self.rollout), 6)
+
+
+class TestMemoryProfileFunctions(unittest.TestCase):
+    """Unit testing of memory profiling."""
+
+    def test_deep_size(self):
+        """Test deep_size counts reachable objects once"""
+        user = infect.User("A")
+        self.assertTrue(memprofile.deep_size(user) > 0)
+
+        users = [user, user]
+        self.assertEqual(memprofile.deep_size(users) - sys.getsizeof(users),
+                memprofile.deep_size(user))
+
+        coaching_graph = memprofile.users_only_graph(["A", "B"])
+        self.assertTrue(memprofile.deep_size(coaching_graph) >
+                2 * memprofile.deep_size(user))
+
+    def test_measure_isolated(self):
+        """Test phases measured in a fresh interpreter"""
+        workdir = tempfile.mkdtemp()
+        try:
+            retained, peak = memprofile.measure_isolated("users",
+                    "graphs/graph3.json", workdir)
+            self.assertTrue(retained > 0)
+            self.assertTrue(peak >= retained)
+
+            # A failing phase raises rather than waiting for a result.
+            self.assertRaises(RuntimeError, memprofile.measure_isolated,
+                    "load", os.path.join(workdir, "missing.json"), workdir)
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_check_budget(self):
+        """Test budget checks"""
+        profile = {"bytes_per_user" : 1000.0, "bytes_per_edge" : 60.0}
+        budget = {"bytes_per_user" : 950.0, "bytes_per_edge" : 60.0}
+        self.assertEqual(len(memprofile.check_budget(profile, budget)), 0)
+
+        budget["tolerance"] = 0.05
+        failures = memprofile.check_budget(profile, budget)
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].startswith("bytes_per_user"))
+
+        budget["slack"] = 60.0
+        self.assertEqual(len(memprofile.check_budget(profile, budget)), 0)
+
+
+class TestPortfolioFunctions(unittest.TestCase):
+    """Unit testing of portfolio searches."""
+
+    def setUp(self):
+        """Setup for unit testing"""
+        self.graph3 = infect.json_file_to_coaching_graph("graphs/graph3.json")
+
+    def test_strategies(self):
+        """Test each strategy on its own"""
+        for ordering in ["largest-first", "smallest-first", "random"]:
+            users = portfolio.strategy_infection(self.graph3, ordering, 1.0,
+                    4, 4)
+            self.assertEqual(len(users), 4)
+
+        users = portfolio.strategy_infection(self.graph3, "class-greedy",
+                1.0, 3, 8)
+        self.assertTrue(7 <= len(users) <= 8) # Two overlapping classes, or not
+
+    def test_portfolio(self):
+        """Test the portfolio search"""
+        success = portfolio.portfolio_infection(self.graph3, "best", 5, 8,
+                processes=2, time_limit=30)
+        self.assertTrue(success)
+        num_infected = len(filter(lambda x : "best" in x.features(),
+            self.graph3.nodes()))
+        self.assertEqual(num_infected, 8) # Found by subset sum strategies
+
+        strategy, users = portfolio.plan_portfolio_infection(self.graph3,
+                20, 30, processes=2)
+        self.assertEqual(users, None)
+
+        strategy, users = portfolio.plan_portfolio_infection(self.graph3,
+                1, 13, processes=2, first=True)
+        self.assertTrue(1 <= len(users) <= 13)
+
+    def test_dead_worker(self):
+        """Test a strategy whose worker dies is given up on"""
+        strategy_infection = portfolio.strategy_infection
+        def crash(coaching_graph, ordering, *args):
+            if ordering == "crash":
+                os._exit(1) # As if killed for running out of memory
+            return strategy_infection(coaching_graph, ordering, *args)
+
+        portfolio.strategy_infection = crash # Inherited by forked workers
+        try:
+            strategy, users = portfolio.plan_portfolio_infection(self.graph3,
+                    5, 8, [("crash", 1.0), ("largest-first", 1.0)],
+                    processes=2)
+        finally:
+            portfolio.strategy_infection = strategy_infection
+        self.assertEqual(strategy, ("largest-first", 1.0))
+        self.assertTrue(5 <= len(users) <= 8)
+
+
+class TestOutOfCoreFunctions(unittest.TestCase):
+    """Unit testing of out-of-core component discovery."""
+
+    def setUp(self):
+        """Write graph3 as an edge list in a scratch directory"""
+        self.workdir = tempfile.mkdtemp()
+        self.edges = os.path.join(self.workdir, "edges.csv")
+        self.users = os.path.join(self.workdir, "users.txt")
+        coaching_graph = infect.json_file_to_coaching_graph(
+                "graphs/graph3.json")
+        with open(self.edges, "w") as f:
+            f.write("coach_id,student_id\n")
+            for coach in coaching_graph.all_parents():
+                for student in coach.coaches():
+                    f.write("%s,%s\n" % (coach.id(), student.id()))
+        with open(self.users, "w") as f:
+            f.write("Z\n")
+
+    def tearDown(self):
+        """Remove the scratch directory"""
+        shutil.rmtree(self.workdir)
+
+    def infected_ids(self, chosen):
+        """Return the set of user ids streamed out for chosen labels"""
+        output = os.path.join(self.workdir, "infected.txt")
+        with open(output, "w") as out:
+            outofcore.stream_component_users(self.workdir, chosen, out)
+        with open(output) as f:
+            return set(line.strip() for line in f)
+
+    def check_components(self, budget):
+        """Check components found and infections planned within budget"""
+        num_users = outofcore.find_components(self.edges, self.workdir,
+                self.users, budget)
+        self.assertEqual(num_users, 14)
+
+        labels, sizes = outofcore.read_component_sizes(self.workdir)
+        self.assertEqual(sorted(sizes), [1, 4, 9])
+
+        status, chosen = outofcore.plan_exact_components(self.workdir, 5)
+        self.assertEqual(status, infect.EXACT)
+        self.assertEqual(self.infected_ids(chosen),
+                set(["J", "K", "L", "M", "Z"]))
+
+        chosen = outofcore.plan_limited_components(self.workdir, 10, 12)
+        ids = self.infected_ids(chosen)
+        self.assertEqual(len(ids), 10)
+        self.assertTrue("J" not in ids)
+
+        status, chosen = outofcore.plan_exact_components(self.workdir, 12)
+        self.assertEqual(status, infect.INFEASIBLE)
+        self.assertEqual(sum(sizes[list(labels).index(x)] for x in chosen),
+                13)
+
+    def test_in_memory(self):
+        """Test component discovery with arrays in memory"""
+        self.check_components(outofcore.DEFAULT_BUDGET)
+
+    def test_memory_mapped(self):
+        """Test component discovery with arrays mapped to disk"""
+        self.check_components(0)
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, "parent")))
+
+    def test_many_components(self):
+        """Test exact infections over more components than recursion allows"""
+        with open(self.edges, "w") as f:
+            for i in range(3000):
+                f.write("coach%d,student%d\n" % (i, i))
+        num_users = outofcore.find_components(self.edges, self.workdir)
+        self.assertEqual(num_users, 6000)
+
+        status, chosen = outofcore.plan_exact_components(self.workdir, 2400)
+        self.assertEqual(status, infect.EXACT)
+        self.assertEqual(len(self.infected_ids(chosen)), 2400)
+
 if __name__ == "__main__":
     unittest.main()
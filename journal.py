@@ -0,0 +1,50 @@
+###############################################################################
+# Maintain the rollout journals written by infect.py --journal.
+###############################################################################
+
+#------------------------------------------------------------------------------
+# Various informative variables for documentation.
+#------------------------------------------------------------------------------
+__author__  = 'Craig Struble <strubleca@yahoo.com>'
+__date__    = 'December 13, 2014'
+__version__ = '1'
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+import infect
+import time
+from argparse import ArgumentParser
+
+def main(args):
+    """Main script"""
+
+    if args.compact:
+        num_entries = infect.compact_journal(args.snapshot, args.journal,
+                args.output)
+        print "Folded %d infections into %s" % (num_entries,
+                args.output or args.snapshot)
+        return
+
+    for feature, user_ids, timestamp in infect.read_journal(args.journal):
+        print "%s: %s for %d users" % (time.ctime(timestamp), feature,
+                len(user_ids))
+
+#------------------------------------------------------------------------------
+# Main script
+#------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = ArgumentParser(description="List or compact a rollout journal.")
+    parser.add_argument('snapshot',
+            help="JSON snapshot of the coaching graph")
+    parser.add_argument('journal',
+            help="rollout journal of infections since the snapshot")
+    parser.add_argument("-c", "--compact",
+            action="store_true",
+            help="fold the journal into a new snapshot and empty it")
+    parser.add_argument("-o", "--output",
+            help="with --compact, write the new snapshot here instead of "
+                 "replacing the old one")
+    args = parser.parse_args()
+
+    main(args)
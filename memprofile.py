@@ -0,0 +1,343 @@
+###############################################################################
+# Profile the memory footprint of coaching graphs and check it against a
+# budget.
+###############################################################################
+
+#------------------------------------------------------------------------------
+# Various informative variables for documentation.
+#------------------------------------------------------------------------------
+__author__  = 'Craig Struble <strubleca@yahoo.com>'
+__date__    = 'December 13, 2014'
+__version__ = '1'
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+import graph
+import infect
+import randomgraph
+import gc
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from argparse import ArgumentParser
+
+try:
+    import tracemalloc # Python 3.4 and later, or the pytracemalloc backport
+except ImportError:
+    tracemalloc = None
+
+#------------------------------------------------------------------------------
+# Constants
+#------------------------------------------------------------------------------
+DEFAULT_BUDGET_FILE = "memory_budget.json"
+DEFAULT_CLASSES = [50, 200, 800]    # Graph sizes, in classes of 10-30 users
+SAMPLE_INTERVAL = 0.001             # Seconds between RSS samples
+
+# Run by a fresh interpreter to profile a phase on its own.
+PHASE_SCRIPT = "import memprofile, sys; memprofile.run_phase(*sys.argv[1:])"
+
+METRICS = ["bytes_per_user", "bytes_per_edge", "peak_load_per_user",
+        "peak_infect_per_user", "peak_serialize_per_user"]
+
+#------------------------------------------------------------------------------
+# Measuring memory
+#------------------------------------------------------------------------------
+def deep_size(obj):
+    """Return the bytes used by obj and every object reachable from it.
+
+    Classes, functions and modules are shared by everything, so they are
+    neither counted nor followed.
+    """
+    shared = (type, types.ModuleType, types.FunctionType,
+            types.BuiltinFunctionType)
+    seen = set()
+    total = 0
+    objects = [obj]
+    while len(objects) > 0:
+        current = objects.pop()
+        if id(current) in seen or isinstance(current, shared):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+        objects.extend(gc.get_referents(current))
+
+    return total
+
+def current_rss():
+    """Return the resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # ru_maxrss is in kilobytes on Linux, and only grows.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakSampler(threading.Thread):
+    """Sample the resident set size in the background, keeping the peak."""
+
+    def __init__(self):
+        super(PeakSampler, self).__init__()
+        self.daemon = True
+        self.peak = current_rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, current_rss())
+            time.sleep(SAMPLE_INTERVAL)
+
+    def stop(self):
+        """Stop sampling and return the peak."""
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+def measure(function, *args):
+    """Call function with args, measuring its memory use.
+
+    Returns (result, retained, peak). retained is the bytes still in use
+    by the result and peak is the most extra memory in use at any time
+    during the call. These come from tracemalloc when it is available.
+    Otherwise retained is the deep size of the result and peak is
+    sampled from the resident set size, which is coarser.
+    """
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            result = function(*args)
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, retained, peak
+
+    start = current_rss()
+    sampler = PeakSampler()
+    sampler.start()
+    try:
+        result = function(*args)
+    finally:
+        peak = sampler.stop() - start
+    retained = deep_size(result) if result is not None else 0
+    return result, retained, max(peak, retained)
+
+#------------------------------------------------------------------------------
+# Profiling phases
+#------------------------------------------------------------------------------
+def users_only_graph(user_ids):
+    """Return a coaching graph of users without coaching relationships."""
+    coaching_graph = graph.Graph(directed=True)
+    for user_id in user_ids:
+        coaching_graph.add_node(infect.User(user_id))
+    return coaching_graph
+
+def load_phase(graph_file, workdir):
+    """Measure loading the graph in graph_file."""
+    coaching_graph, retained, peak = measure(
+            infect.json_file_to_coaching_graph, graph_file)
+    return retained, peak
+
+def users_phase(graph_file, workdir):
+    """Measure building a graph of the same users without edges."""
+    coaching_graph = infect.json_file_to_coaching_graph(graph_file)
+    user_ids = [x.id() for x in coaching_graph.nodes()]
+    del coaching_graph
+    result, retained, peak = measure(users_only_graph, user_ids)
+    return retained, peak
+
+def infect_phase(graph_file, workdir):
+    """Measure a limited infection of a tenth to a fifth of the users."""
+    coaching_graph = infect.json_file_to_coaching_graph(graph_file)
+    num_users = len(coaching_graph.nodes())
+    result, retained, peak = measure(infect.limited_infection,
+            coaching_graph, "profile", num_users // 10, num_users // 5)
+    return retained, peak
+
+def serialize_phase(graph_file, workdir):
+    """Measure saving the graph as JSON."""
+    coaching_graph = infect.json_file_to_coaching_graph(graph_file)
+    out_file = os.path.join(workdir, "serialized.json")
+    result, retained, peak = measure(infect.coaching_graph_to_json_file,
+            coaching_graph, out_file)
+    return retained, peak
+
+PHASES = {"load" : load_phase, "users" : users_phase,
+        "infect" : infect_phase, "serialize" : serialize_phase}
+
+def run_phase(phase, graph_file, workdir):
+    """Measure a phase, printing (retained, peak) as JSON on the last line."""
+    print json.dumps(PHASES[phase](graph_file, workdir))
+
+def measure_isolated(phase, graph_file, workdir):
+    """Measure a phase on the graph in graph_file in a fresh interpreter.
+
+    A forked child would reuse memory its parent already had resident,
+    hiding the phase's allocations from the resident set size. A fresh
+    interpreter only holds what the phase and the graph it loads need.
+
+    Returns (retained, peak) as measure does. Raises RuntimeError if the
+    phase fails.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    child = subprocess.Popen([sys.executable, "-c", PHASE_SCRIPT, phase,
+        graph_file, workdir], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        env=env)
+    out, err = child.communicate()
+    if child.returncode != 0:
+        raise RuntimeError("Profiling %s failed:\n%s" % (phase, err))
+
+    retained, peak = json.loads(out.splitlines()[-1])
+    return retained, peak
+
+def profile_graph(graph_file, workdir):
+    """Profile loading, infecting and serializing the graph in graph_file.
+
+    Each phase is measured in its own interpreter. Returns a dictionary
+    of the number of users and edges, with the bytes per user and per
+    edge of a loaded graph and the peak bytes per user of each phase.
+    """
+
+    coaching_graph = infect.json_file_to_coaching_graph(graph_file)
+    num_users = len(coaching_graph.nodes())
+    num_edges = sum(len(x.coaches()) for x in coaching_graph.nodes())
+    del coaching_graph
+
+    loaded, load_peak = measure_isolated("load", graph_file, workdir)
+    # Users cost the same with or without edges. Whatever is left over
+    # after that is the cost of the edges.
+    users_only, peak = measure_isolated("users", graph_file, workdir)
+    retained, infect_peak = measure_isolated("infect", graph_file, workdir)
+    retained, serialize_peak = measure_isolated("serialize", graph_file,
+            workdir)
+
+    return {"users" : num_users,
+            "edges" : num_edges,
+            "bytes_per_user" : float(users_only) / num_users,
+            "bytes_per_edge" : float(loaded - users_only) / max(num_edges, 1),
+            "peak_load_per_user" : float(load_peak) / num_users,
+            "peak_infect_per_user" : float(infect_peak) / num_users,
+            "peak_serialize_per_user" : float(serialize_peak) / num_users}
+
+def profile_sizes(class_counts, seed=0):
+    """Profile random coaching graphs with each number of classes."""
+    random.seed(seed)
+    workdir = tempfile.mkdtemp()
+    try:
+        profiles = []
+        for num_classes in class_counts:
+            coaching_graph = randomgraph.random_coaching_graph(num_classes,
+                    10, 30, 0.05)
+            graph_file = os.path.join(workdir, "graph.json")
+            infect.coaching_graph_to_json_file(coaching_graph, graph_file)
+            del coaching_graph
+            profiles.append(profile_graph(graph_file, workdir))
+    finally:
+        shutil.rmtree(workdir)
+
+    return profiles
+
+#------------------------------------------------------------------------------
+# Budgets
+#------------------------------------------------------------------------------
+def check_budget(profile, budget):
+    """Return messages for each metric of profile over budget.
+
+    budget maps metrics to their allowed values, and may give a
+    tolerance as a fraction of each value (default 0.1) and a slack of
+    bytes added to each value (default 0), which absorbs the noise in
+    small sampled peaks.
+    """
+    tolerance = budget.get("tolerance", 0.1)
+    slack = budget.get("slack", 0.0)
+    failures = []
+    for metric in METRICS:
+        if metric not in budget:
+            continue
+        limit = budget[metric] * (1.0 + tolerance) + slack
+        if profile[metric] > limit:
+            failures.append("%s is %.1f, over the budget of %.1f" % (
+                metric, profile[metric], limit))
+
+    return failures
+
+def print_profiles(profiles):
+    """Print a table of profiles."""
+    print "%8s %8s %10s %10s %10s %10s %10s" % ("users", "edges",
+            "B/user", "B/edge", "load B/u", "infect B/u", "save B/u")
+    for profile in profiles:
+        print "%8d %8d %10.1f %10.1f %10.1f %10.1f %10.1f" % (
+                profile["users"], profile["edges"],
+                profile["bytes_per_user"], profile["bytes_per_edge"],
+                profile["peak_load_per_user"],
+                profile["peak_infect_per_user"],
+                profile["peak_serialize_per_user"])
+
+def main(args):
+    """Main script"""
+
+    profiles = profile_sizes(args.classes)
+    if tracemalloc is None:
+        print "tracemalloc is unavailable; peaks are sampled from RSS."
+    print_profiles(profiles)
+
+    largest = profiles[-1]
+    if args.update:
+        budget = dict((x, round(largest[x], 1)) for x in METRICS)
+        budget["tolerance"] = args.tolerance
+        budget["slack"] = args.slack
+        json.dump(budget, open(args.budget, "w"), indent=4, sort_keys=True)
+        print "Updated budget in %s" % args.budget
+        return
+
+    if not os.path.exists(args.budget):
+        return
+
+    failures = check_budget(largest, json.load(open(args.budget)))
+    for failure in failures:
+        print "FAIL: %s" % failure
+    if len(failures) > 0:
+        sys.exit(1)
+    print "Memory use is within the budget in %s" % args.budget
+
+#------------------------------------------------------------------------------
+# Main script
+#------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = ArgumentParser(
+            description="Profile the memory use of coaching graphs.")
+    parser.add_argument("-b", "--budget",
+            default=DEFAULT_BUDGET_FILE,
+            metavar='FILE',
+            help="JSON budget to check against (default %(default)s)")
+    parser.add_argument("-c", "--classes", nargs='+',
+            type=int,
+            default=DEFAULT_CLASSES,
+            metavar='NUM_CLASS',
+            help="numbers of classes in the random graphs to profile")
+    parser.add_argument("-u", "--update",
+            action="store_true",
+            help="write the profile of the largest graph as the budget")
+    parser.add_argument("-t", "--tolerance",
+            type=float,
+            default=0.25,
+            help="with --update, the fraction a metric may grow by "
+                 "(default %(default)s)")
+    parser.add_argument("-s", "--slack",
+            type=float,
+            default=32.0,
+            help="with --update, bytes each metric may grow by on top of "
+                 "the tolerance (default %(default)s)")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,445 @@
+###############################################################################
+# Out-of-core component discovery for coaching graphs larger than memory.
+###############################################################################
+
+#------------------------------------------------------------------------------
+# Various informative variables for documentation.
+#------------------------------------------------------------------------------
+__author__  = 'Craig Struble <strubleca@yahoo.com>'
+__date__    = 'December 13, 2014'
+__version__ = '1'
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+import infect
+import array
+import csv
+import hashlib
+import mmap
+import os
+import struct
+import time
+from argparse import ArgumentParser
+
+#------------------------------------------------------------------------------
+# Constants
+#------------------------------------------------------------------------------
+DEFAULT_BUDGET = 64 * 1024 * 1024   # Default memory budget in bytes
+
+INT_FORMAT = "<q"                   # Parent, size and label entries
+INT_SIZE = struct.calcsize(INT_FORMAT)
+SLOT_FORMAT = "<16sq"               # Id hash table slots: digest, index
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+EMPTY_DIGEST = "\0" * 16
+CACHE_ENTRY_SIZE = 128              # Approximate bytes per cached id
+
+IDS_FILE = "ids"                    # One user id per line, in index order
+LABELS_FILE = "labels"              # Component label for each index
+SIZES_FILE = "sizes"                # "label,size" for each component
+
+#------------------------------------------------------------------------------
+# Fixed size integer arrays, in memory or memory mapped to disk
+#------------------------------------------------------------------------------
+class IntArray(object):
+    """A fixed length array of 64 bit integers.
+
+    The array is kept in anonymous memory when path is None, otherwise it
+    is memory mapped to the file at path so the operating system can page
+    it in and out as needed.
+    """
+
+    def __init__(self, length, path=None, format=INT_FORMAT):
+        self._format = format
+        self._item_size = struct.calcsize(format)
+        self._length = length
+        num_bytes = max(length * self._item_size, 1)
+        self._path = path
+        if path is None:
+            self._file = None
+            self._map = mmap.mmap(-1, num_bytes)
+        else:
+            self._file = open(path, "w+b")
+            self._file.truncate(num_bytes)
+            self._map = mmap.mmap(self._file.fileno(), num_bytes)
+
+    def __len__(self):
+        return self._length
+
+    def get(self, i):
+        """Return the item at index i."""
+        return struct.unpack_from(self._format, self._map,
+                i * self._item_size)
+
+    def set(self, i, *values):
+        """Store values as the item at index i."""
+        struct.pack_into(self._format, self._map, i * self._item_size,
+                *values)
+
+    def close(self):
+        """Release the memory or file backing the array."""
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._path)
+
+def make_array(length, budget, workdir, name, format=INT_FORMAT):
+    """Create an IntArray in memory if it fits in budget, on disk otherwise.
+
+    Returns the array and the budget left over.
+    """
+    num_bytes = length * struct.calcsize(format)
+    if num_bytes <= budget:
+        return IntArray(length, format=format), budget - num_bytes
+
+    return IntArray(length, os.path.join(workdir, name), format), budget
+
+#------------------------------------------------------------------------------
+# Interning user ids as dense integer indices
+#------------------------------------------------------------------------------
+class IdTable(object):
+    """Assign dense indices to user ids, writing ids out in index order.
+
+    Ids are found with an open addressing hash table keyed by the MD5
+    digest of the id, so only digests and indices are stored, not the
+    ids themselves. A small dictionary of recently seen ids, bounded by
+    cache_size entries, avoids hashing ids that repeat close together,
+    such as a coach and their students.
+    """
+
+    def __init__(self, capacity, ids_file, budget, workdir, cache_size):
+        num_slots = 1
+        while num_slots < 2 * capacity:
+            num_slots *= 2
+        self._mask = num_slots - 1
+        self._slots, self.budget = make_array(num_slots, budget, workdir,
+                "idtable", SLOT_FORMAT)
+        self._ids_file = ids_file
+        self._cache = dict()
+        self._cache_size = cache_size
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def intern(self, user_id):
+        """Return the index for user_id, assigning a new one if needed."""
+        if user_id in self._cache:
+            return self._cache[user_id]
+
+        digest = hashlib.md5(user_id).digest()
+        slot = struct.unpack_from("<Q", digest)[0] & self._mask
+        while True:
+            found, index = self._slots.get(slot)
+            if found == EMPTY_DIGEST:
+                index = self._count
+                self._count += 1
+                self._slots.set(slot, digest, index)
+                self._ids_file.write(user_id + "\n")
+                break
+            elif found == digest:
+                break
+            slot = (slot + 1) & self._mask
+
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[user_id] = index
+        return index
+
+    def close(self):
+        """Release the hash table."""
+        self._slots.close()
+
+#------------------------------------------------------------------------------
+# Union-find over memory mapped parent and size arrays
+#------------------------------------------------------------------------------
+class DiskUnionFind(object):
+    """Disjoint sets of user indices, using union by size and path halving."""
+
+    def __init__(self, capacity, budget, workdir):
+        self._parent, budget = make_array(capacity, budget, workdir, "parent")
+        self._size, self.budget = make_array(capacity, budget, workdir, "size")
+        self._count = 0
+
+    def add(self, index):
+        """Add singleton sets up to and including index."""
+        while self._count <= index:
+            self._parent.set(self._count, self._count)
+            self._size.set(self._count, 1)
+            self._count += 1
+
+    def find(self, index):
+        """Return the representative of the set containing index."""
+        parent = self._parent.get(index)[0]
+        while parent != index:
+            grandparent = self._parent.get(parent)[0]
+            self._parent.set(index, grandparent)
+            index = parent
+            parent = grandparent
+
+        return index
+
+    def union(self, index1, index2):
+        """Merge the sets containing index1 and index2."""
+        root1 = self.find(index1)
+        root2 = self.find(index2)
+        if root1 == root2:
+            return
+
+        size1 = self._size.get(root1)[0]
+        size2 = self._size.get(root2)[0]
+        if size1 < size2:
+            root1, root2 = root2, root1
+        self._parent.set(root2, root1)
+        self._size.set(root1, size1 + size2)
+
+    def size(self, root):
+        """Return the size of the set with representative root."""
+        return self._size.get(root)[0]
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        """Release the parent and size arrays."""
+        self._parent.close()
+        self._size.close()
+
+#------------------------------------------------------------------------------
+# Component discovery
+#------------------------------------------------------------------------------
+def read_edges(edges_file):
+    """Generate (coach_id, student_id) pairs from a CSV edge list,
+    skipping a coach_id,student_id header row.
+    """
+    with open(edges_file, "rb") as f:
+        first = True
+        for row in csv.reader(f):
+            if len(row) >= 2:
+                edge = [row[0].strip(), row[1].strip()]
+                if not (first and edge == infect.EDGE_LIST_HEADER):
+                    yield tuple(edge)
+            first = False
+
+def read_users(users_file):
+    """Generate user ids from a file with one user id per line."""
+    with open(users_file, "rb") as f:
+        for line in f:
+            user_id = line.strip()
+            if user_id:
+                yield user_id
+
+def count_lines(filename):
+    """Count the lines of a file in one sequential pass."""
+    count = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            count += 1
+    return count
+
+def find_components(edges_file, workdir, users_file=None,
+        budget=DEFAULT_BUDGET):
+    """Discover the weakly connected components of a coaching edge list.
+
+    The edge list is a CSV file with one coach_id,student_id pair per
+    line. Users without any coaching relationships can be listed, one
+    per line, in users_file. Results are written to workdir: the ids
+    file lists user ids in index order, the labels file holds the
+    component label of each index, and the sizes file has a
+    label,size line for each component.
+
+    Arrays are kept in memory while they fit in budget bytes and are
+    memory mapped to files in workdir otherwise.
+
+    Returns the number of users found.
+    """
+
+    # First pass: bound the number of distinct users.
+    capacity = 2 * count_lines(edges_file)
+    if users_file is not None:
+        capacity += count_lines(users_file)
+
+    # Second pass: intern ids and union coaches with their students.
+    # An eighth of the budget goes to the cache of recently seen ids,
+    # at roughly CACHE_ENTRY_SIZE bytes per entry.
+    cache_size = max(budget // (8 * CACHE_ENTRY_SIZE), 1024)
+    budget = max(budget - CACHE_ENTRY_SIZE * cache_size, 0)
+    with open(os.path.join(workdir, IDS_FILE), "wb") as ids_file:
+        ids = IdTable(capacity, ids_file, budget, workdir, cache_size)
+        sets = DiskUnionFind(capacity, ids.budget, workdir)
+        try:
+            if users_file is not None:
+                for user_id in read_users(users_file):
+                    sets.add(ids.intern(user_id))
+
+            for coach_id, student_id in read_edges(edges_file):
+                coach = ids.intern(coach_id)
+                student = ids.intern(student_id)
+                sets.add(max(coach, student))
+                sets.union(coach, student)
+        finally:
+            ids.close()
+
+    # Third pass: write component labels and sizes.
+    try:
+        num_users = len(sets)
+        with open(os.path.join(workdir, LABELS_FILE), "wb") as labels:
+            with open(os.path.join(workdir, SIZES_FILE), "wb") as sizes:
+                for index in xrange(num_users):
+                    root = sets.find(index)
+                    labels.write(struct.pack(INT_FORMAT, root))
+                    if root == index:
+                        sizes.write("%d,%d\n" % (root, sets.size(root)))
+    finally:
+        sets.close()
+
+    return num_users
+
+def read_component_sizes(workdir):
+    """Return parallel arrays of component labels and sizes from workdir.
+
+    Unlike the rest of this module, these take memory in proportion to
+    the number of components, but only a machine word per entry.
+    """
+    labels = array.array("l")
+    sizes = array.array("l")
+    with open(os.path.join(workdir, SIZES_FILE), "rb") as f:
+        for line in f:
+            label, size = line.split(",")
+            labels.append(int(label))
+            sizes.append(int(size))
+
+    return labels, sizes
+
+def stream_component_users(workdir, chosen_labels, out):
+    """Write the ids of users in the chosen components to out.
+
+    The ids and labels files are read together in one sequential pass.
+    Returns the number of user ids written.
+    """
+    chosen_labels = set(chosen_labels)
+    count = 0
+    with open(os.path.join(workdir, IDS_FILE), "rb") as ids:
+        with open(os.path.join(workdir, LABELS_FILE), "rb") as labels:
+            for line in ids:
+                label = struct.unpack(INT_FORMAT, labels.read(INT_SIZE))[0]
+                if label in chosen_labels:
+                    out.write(line)
+                    count += 1
+
+    return count
+
+#------------------------------------------------------------------------------
+# Planning infections from component sizes
+#------------------------------------------------------------------------------
+def plan_limited_components(workdir, min_users, max_users):
+    """Return component labels to infect for between min and max users.
+
+    Only whole components are chosen, as in approx_component_infection.
+    Returns None if no collection of components is within range.
+
+    Planning holds the component sizes in memory, along with the
+    candidate collections of approx_subset_sum, of which there are at
+    most max_users. Its memory grows with those rather than staying
+    within a budget.
+    """
+    labels, sizes = read_component_sizes(workdir)
+    chosen = infect.approx_subset_sum(sizes, min_users, max_users)
+    if sum(sizes[i] for i in chosen) < min_users:
+        return None
+
+    return [labels[i] for i in chosen]
+
+def plan_exact_components(workdir, num_users, time_budget=None,
+        progress=None, cancel=None):
+    """Find component labels totalling exactly num_users, as in
+    plan_anytime_exact_infection, giving up after time_budget seconds or
+    when cancel is set.
+
+    Returns (status, labels) as in anytime_subset_sum, where labels are
+    those of the closest collection of components found.
+    """
+    labels, sizes = read_component_sizes(workdir)
+    deadline = None
+    if time_budget is not None:
+        deadline = time.time() + time_budget
+
+    status, solution = infect.anytime_subset_sum(sizes, num_users, deadline,
+            progress, cancel)
+    return status, [labels[i] for i in solution]
+
+def main(args):
+    """Main script"""
+
+    budget = int(args.budget * 1024 * 1024)
+    num_users = find_components(args.edgesfilename, args.workdir,
+            args.users, budget)
+    print "Found components for %d users in %s" % (num_users, args.workdir)
+
+    chosen = None
+    if args.limited_infection:
+        chosen = plan_limited_components(args.workdir,
+                args.limited_infection[0], args.limited_infection[1])
+    elif args.exact_infection is not None:
+        progress = infect.print_progress if args.progress else None
+        status, chosen = plan_exact_components(args.workdir,
+                args.exact_infection, args.time_budget, progress)
+        print "Exact infection of %d users: %s" % (args.exact_infection,
+                status)
+        if status != infect.EXACT and not args.best_effort:
+            chosen = None
+    else:
+        return
+
+    if chosen is None:
+        print "No infection within the requested number of users"
+        return
+
+    with open(args.output, "wb") as out:
+        count = stream_component_users(args.workdir, chosen, out)
+    print "Wrote %d user ids to %s" % (count, args.output)
+
+#------------------------------------------------------------------------------
+# Main script
+#------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = ArgumentParser(
+            description="Find components of a coaching graph on disk.")
+    parser.add_argument('edgesfilename',
+            help="CSV file of coach_id,student_id coaching relationships")
+    parser.add_argument('workdir',
+            help="directory for the ids, labels and sizes files")
+    parser.add_argument("-u", "--users",
+            metavar='FILE',
+            help="file of user ids, one per line, including lone users")
+    parser.add_argument("-b", "--budget",
+            type=float,
+            default=DEFAULT_BUDGET / (1024 * 1024),
+            metavar='MB',
+            help="memory budget in megabytes (default %(default)s)")
+    parser.add_argument("-o", "--output",
+            default="infected.txt",
+            help="file receiving the ids of users to infect")
+    parser.add_argument("--time-budget",
+            type=float,
+            metavar='SECONDS',
+            help="with -e, stop searching after SECONDS")
+    parser.add_argument("--progress",
+            action="store_true",
+            help="with -e, report progress on standard error")
+    parser.add_argument("--best-effort",
+            action="store_true",
+            help="with -e, infect the closest number of users found if "
+                 "the exact number isn't")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-e", "--exact-infection",
+            type=int,
+            metavar='NUM',
+            help="infect exactly NUM users if possible")
+    group.add_argument("-l", "--limited-infection", nargs=2,
+            type=int,
+            metavar=('MIN', 'MAX'),
+            help="infect MIN to MAX users if possible")
+    args = parser.parse_args()
+
+    main(args)
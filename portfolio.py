@@ -0,0 +1,278 @@
+###############################################################################
+# Search for limited infections with a portfolio of strategies in parallel.
+###############################################################################
+
+#------------------------------------------------------------------------------
+# Various informative variables for documentation.
+#------------------------------------------------------------------------------
+__author__  = 'Craig Struble <strubleca@yahoo.com>'
+__date__    = 'December 13, 2014'
+__version__ = '1'
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+import infect
+import multiprocessing
+import multiprocessing.queues
+import os
+import random
+import time
+from Queue import Queue, Empty
+from argparse import ArgumentParser
+
+#------------------------------------------------------------------------------
+# Strategies
+#------------------------------------------------------------------------------
+# Each strategy is an ordering of components and classes, and a scale
+# applied to the trim epsilon of the approximate subset sum. Smaller
+# scales trim less, which is slower but can get closer to the maximum.
+DEFAULT_PORTFOLIO = [("largest-first", 1.0), ("smallest-first", 1.0),
+        ("random", 1.0), ("class-greedy", 1.0), ("largest-first", 0.1),
+        ("random", 0.1)]
+
+POLL_INTERVAL = 0.1 # Seconds between checks on workers
+
+def order_seeds(seeds, ordering, size, seed):
+    """Return seeds ordered by their size for the given ordering."""
+    seeds = list(seeds)
+    if ordering == "largest-first" or ordering == "class-greedy":
+        seeds.sort(key=size, reverse=True)
+    elif ordering == "smallest-first":
+        seeds.sort(key=size)
+    elif ordering == "random":
+        random.Random(seed).shuffle(seeds)
+    else:
+        raise ValueError("Unknown ordering %s" % ordering)
+
+    return seeds
+
+def class_size(user):
+    """Return the number of users in the class user coaches."""
+    return 1 + len(user.coaches())
+
+def class_greedy_infection(coaching_graph, seeds, max_users):
+    """Infect whole classes in order of seeds while they fit in max_users."""
+    users = set()
+    for seed in seeds:
+        new_users = set(seed.coaches())
+        new_users.add(seed)
+        new_users -= users
+        if len(users) + len(new_users) <= max_users:
+            users |= new_users
+
+    return users
+
+def strategy_infection(coaching_graph, ordering, scale, min_users, max_users,
+        seed=0):
+    """Plan a limited infection as limited_infection does, but ordering
+    components and classes by ordering and scaling the trim epsilon by
+    scale. The class-greedy ordering skips whole components and infects
+    the largest classes that fit.
+
+    Returns the set of users chosen, which may be out of range.
+    """
+
+    class_seeds = coaching_graph.all_parents() | coaching_graph.all_singletons()
+    if ordering == "class-greedy":
+        seeds = order_seeds(class_seeds, ordering, class_size, seed)
+        return class_greedy_infection(coaching_graph, seeds, max_users)
+
+    components = order_seeds(infect.cached_components(coaching_graph),
+            ordering, len, seed)
+    epsilon = scale * ((float(max_users) / min_users) - 1.0)
+    users = infect.approx_component_infection(coaching_graph, min_users,
+            max_users, components, epsilon)
+    if len(users) < min_users:
+        seeds = order_seeds(class_seeds - users, ordering, class_size, seed)
+        min_class_users = min_users - len(users)
+        max_class_users = max_users - len(users)
+        epsilon = scale * ((float(max_class_users) / min_class_users) - 1.0)
+        users |= infect.approx_class_infection(coaching_graph, seeds,
+                min_class_users, max_class_users, epsilon)
+
+    return users
+
+#------------------------------------------------------------------------------
+# Worker processes
+#------------------------------------------------------------------------------
+worker_graph = None   # The coaching graph, inherited by forked workers
+worker_started = None # Queue of (index, pid) for strategies started
+
+def init_worker(coaching_graph, started):
+    """Give a worker process the coaching graph to plan on, and the queue
+    to announce the strategies it starts on.
+    """
+    global worker_graph, worker_started
+    worker_graph = coaching_graph
+    worker_started = started
+
+def worker_alive(pid):
+    """Return whether the worker process with pid is still running."""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def run_strategy(index, ordering, scale, min_users, max_users, seed):
+    """Run a strategy in a worker, returning (index, user ids).
+
+    User ids are None if the strategy failed with an exception.
+    """
+    worker_started.put((index, os.getpid()))
+    try:
+        users = strategy_infection(worker_graph, ordering, scale, min_users,
+                max_users, seed + index)
+        return index, [x.id() for x in users]
+    except Exception:
+        return index, None
+
+#------------------------------------------------------------------------------
+# Portfolio search
+#------------------------------------------------------------------------------
+def plan_portfolio_infection(coaching_graph, min_users, max_users,
+        portfolio=DEFAULT_PORTFOLIO, time_limit=None, first=False,
+        processes=None, seed=0):
+    """Run each (ordering, scale) strategy of portfolio in a process pool.
+
+    With first, the first infection within range is returned. Otherwise
+    the largest infection within range found within time_limit seconds
+    (no limit by default) is returned. Workers still running are
+    terminated. The graph is inherited by forked workers rather than
+    sent to them, so only the chosen user ids are passed back.
+
+    Workers are checked every POLL_INTERVAL seconds. A strategy whose
+    worker died, for example killed for running out of memory, counts
+    as failed rather than being waited on forever.
+
+    Returns a (strategy, users) pair, or (None, None) if no strategy
+    found an infection within range.
+    """
+
+    results = Queue()
+    # Announcements are written straight to a pipe rather than by a
+    # feeder thread, so they aren't lost when a worker dies abruptly.
+    started = multiprocessing.queues.SimpleQueue()
+    pool = multiprocessing.Pool(processes, init_worker,
+            (coaching_graph, started))
+    try:
+        for index, (ordering, scale) in enumerate(portfolio):
+            pool.apply_async(run_strategy, (index, ordering, scale,
+                min_users, max_users, seed), callback=results.put)
+        pool.close()
+
+        best = (None, None)
+        deadline = None
+        if time_limit is not None:
+            deadline = time.time() + time_limit
+        running = dict() # Worker pids of strategies started, by index
+        done = set()     # Indices of strategies finished or lost
+        while len(done) < len(portfolio):
+            timeout = POLL_INTERVAL
+            if deadline is not None:
+                timeout = min(deadline - time.time(), timeout)
+                if timeout <= 0:
+                    break
+            try:
+                index, user_ids = results.get(timeout=timeout)
+            except Empty:
+                # Nothing finished, so look for strategies whose worker
+                # died without returning.
+                while not started.empty():
+                    index, pid = started.get()
+                    if index not in done:
+                        running[index] = pid
+                for index, pid in running.items():
+                    if not worker_alive(pid):
+                        del running[index]
+                        done.add(index)
+                continue
+
+            running.pop(index, None)
+            done.add(index)
+            if user_ids is None or not (
+                    min_users <= len(user_ids) <= max_users):
+                continue
+            if best[1] is None or len(user_ids) > len(best[1]):
+                best = (portfolio[index], user_ids)
+            if first:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    strategy, user_ids = best
+    if user_ids is None:
+        return None, None
+
+    return strategy, set(coaching_graph.find_node(x) for x in user_ids)
+
+def portfolio_infection(coaching_graph, feature, min_users, max_users,
+        **options):
+    """Perform a limited infection found by plan_portfolio_infection.
+
+    Returns True if the infection was successful, False otherwise.
+    """
+    strategy, users = plan_portfolio_infection(coaching_graph, min_users,
+            max_users, **options)
+    if users is None:
+        return False
+
+    infect.apply_infection(users, feature)
+    return True
+
+def main(args):
+    """Main script"""
+
+    coaching_graph = infect.json_file_to_coaching_graph(args.infilename)
+    strategy, users = plan_portfolio_infection(coaching_graph, args.min,
+            args.max, time_limit=args.time_limit, first=args.first,
+            processes=args.processes, seed=args.seed)
+    if users is None:
+        print "No strategy infected between %d and %d users" % (args.min,
+                args.max)
+    else:
+        print "Strategy %s with scale %g infected %d users" % (strategy[0],
+                strategy[1], len(users))
+        infect.apply_infection(users, args.feature)
+
+    infect.coaching_graph_to_json_file(coaching_graph, args.outfilename)
+
+#------------------------------------------------------------------------------
+# Main script
+#------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = ArgumentParser(
+            description="Infect a coaching graph with a portfolio search.")
+    parser.add_argument('feature',
+            help="infect the graph with this feature")
+    parser.add_argument('infilename',
+            help="input file containing coaching graph")
+    parser.add_argument('outfilename',
+            help="output file containing infected graph")
+    parser.add_argument('min',
+            metavar='MIN',
+            type=int,
+            help="minimum number of users to infect")
+    parser.add_argument('max',
+            metavar='MAX',
+            type=int,
+            help="maximum number of users to infect")
+    parser.add_argument("-t", "--time-limit",
+            type=float,
+            metavar='SECONDS',
+            help="return the best infection found within SECONDS")
+    parser.add_argument("-f", "--first",
+            action="store_true",
+            help="return the first infection within range")
+    parser.add_argument("-p", "--processes",
+            type=int,
+            help="number of worker processes (default: one per CPU)")
+    parser.add_argument("-s", "--seed",
+            type=int,
+            default=0,
+            help="seed for random orderings (default %(default)s)")
+    args = parser.parse_args()
+
+    main(args)
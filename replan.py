@@ -0,0 +1,259 @@
+###############################################################################
+# Incremental re-planning of a rollout as a coaching graph grows.
+###############################################################################
+
+#------------------------------------------------------------------------------
+# Various informative variables for documentation.
+#------------------------------------------------------------------------------
+__author__  = 'Craig Struble <strubleca@yahoo.com>'
+__date__    = 'December 13, 2014'
+__version__ = '1'
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+import graph # Our basic graph implementation
+from collections import deque
+
+#------------------------------------------------------------------------------
+# Helper functions
+#------------------------------------------------------------------------------
+def negate_feature(feature):
+    """Return the feature update that undoes feature."""
+    if feature.startswith("!"):
+        return feature[1:]
+    return "!" + feature
+
+def component_members(start):
+    """Return the users weakly connected to start.
+
+    Unlike Graph.connected_component, only the component itself is
+    visited, so the cost does not depend on the size of the graph.
+    """
+    seen = set([start])
+    node_queue = deque([start])
+    while len(node_queue) > 0:
+        current_node = node_queue.popleft()
+        for neighbor in current_node.neighbors():
+            if neighbor not in seen:
+                seen.add(neighbor)
+                node_queue.append(neighbor)
+
+    return seen
+
+#------------------------------------------------------------------------------
+# Incremental infections
+#------------------------------------------------------------------------------
+class IncrementalInfection(object):
+    """A live infection of a coaching graph that follows the graph's growth.
+
+    The weakly connected components of the graph are kept in a
+    graph.DisjointSets, along with the number of infected users in each
+    component and whether the component was infected as a whole (all or
+    none of its users) or by classes. Building the index looks at the
+    whole graph once. After that, apply_delta only does work for the new
+    users and coaching relationships and the components they touch.
+    """
+
+    def __init__(self, coaching_graph, feature, infected=None):
+        """Index coaching_graph, with infected users (default: those with
+        feature) making up the current infection.
+        """
+        self._graph = coaching_graph
+        self._feature = feature
+        self._sets = graph.DisjointSets()
+        self._counts = dict() # Infected users in each component
+        self._whole = dict()  # Whether each component is all or nothing
+
+        if infected is None:
+            infected = [x for x in coaching_graph.nodes()
+                    if feature in x.features()]
+        self.infected = set(infected)
+
+        for user in coaching_graph.nodes():
+            self._sets.add(user.id())
+        for user in coaching_graph.nodes():
+            for student in user.coaches():
+                self._sets.union(user.id(), student.id())
+
+        for user in self.infected:
+            root = self._sets.find(user.id())
+            self._counts[root] = self._counts.get(root, 0) + 1
+        for root in self._sets.roots():
+            count = self._counts.setdefault(root, 0)
+            self._whole[root] = count == 0 or count == self._sets.size(root)
+
+    def __len__(self):
+        """Return the number of infected users."""
+        return len(self.infected)
+
+    def _add_user(self, user):
+        """Add a new user to the index as a component of their own."""
+        self._sets.add(user.id())
+        self._counts[user.id()] = 0
+        self._whole[user.id()] = True
+
+    def _union(self, coach, student):
+        """Merge the components of coach and student, returning the root."""
+        root1 = self._sets.find(coach.id())
+        root2 = self._sets.find(student.id())
+        if root1 == root2:
+            return root1
+
+        count = self._counts.pop(root1) + self._counts.pop(root2)
+        whole1 = self._whole.pop(root1)
+        whole2 = self._whole.pop(root2)
+        whole = whole1 and whole2
+        root = self._sets.union(root1, root2)
+        self._counts[root] = count
+        self._whole[root] = whole
+        return root
+
+    def _infect(self, user):
+        """Give user the feature, if they don't already have it."""
+        if user not in self.infected:
+            self.infected.add(user)
+            self._counts[self._sets.find(user.id())] += 1
+            user.update_feature(self._feature)
+
+    def _cure(self, user):
+        """Take the feature away from user, if they have it."""
+        if user in self.infected:
+            self.infected.discard(user)
+            self._counts[self._sets.find(user.id())] -= 1
+            user.update_feature(negate_feature(self._feature))
+
+    def _repair_component(self, root, min_users, max_users):
+        """Make a component that was infected as a whole consistent again.
+
+        Infects the rest of the component if that stays within max_users,
+        otherwise cures it if that stays within min_users. If neither is
+        possible the component falls back to class infection.
+        """
+        size = self._sets.size(root)
+        count = self._counts[root]
+        if len(self.infected) + size - count <= max_users:
+            for user in component_members(self._graph.find_node(root)):
+                self._infect(user)
+        elif len(self.infected) - count >= min_users:
+            for user in component_members(self._graph.find_node(root)):
+                self._cure(user)
+        else:
+            self._whole[root] = False
+
+    def _repair_class(self, coach, student, max_users):
+        """Keep a coaching relationship in sync, class by class.
+
+        Returns the users newly infected, which is empty if that would
+        exceed max_users.
+        """
+        if coach in self.infected and student not in self.infected:
+            users = [student]
+        elif student in self.infected and coach not in self.infected:
+            users = [coach] + [x for x in coach.coaches()
+                    if x not in self.infected]
+        else:
+            return []
+
+        if len(self.infected) + len(users) > max_users:
+            return []
+
+        for user in users:
+            self._infect(user)
+        return users
+
+    def _repair_classes(self, edges, max_users):
+        """Keep new coaching relationships in class infected components in
+        sync, until nothing changes.
+
+        Infecting users can put relationships already checked out of
+        sync, so the new relationships of each newly infected user are
+        checked again, along with their relationships to their students.
+        The outcome doesn't depend on the order of edges.
+
+        Returns True if every relationship checked is in sync.
+        """
+        edges_of = dict() # New relationships of each user
+        for coach, student in edges:
+            edges_of.setdefault(coach, []).append((coach, student))
+            edges_of.setdefault(student, []).append((coach, student))
+
+        pending = deque(edges)
+        checked = set()
+        while len(pending) > 0:
+            coach, student = pending.popleft()
+            if self._whole[self._sets.find(coach.id())]:
+                continue
+            checked.add((coach, student))
+            for user in self._repair_class(coach, student, max_users):
+                pending.extend(edges_of.get(user, []))
+                pending.extend((user, x) for x in user.coaches())
+
+        return all((coach in self.infected) == (student in self.infected)
+                for coach, student in checked)
+
+    def apply_delta(self, new_users, new_edges, min_users, max_users):
+        """Add users and coaching relationships, then repair the infection.
+
+        new_users are User objects and new_edges are (coach id, student
+        id) pairs. As with Graph.add_node, users whose ids are already in
+        the graph are skipped. Components merged by the new
+        relationships are made consistent: components infected as a whole
+        stay whole, and classes in class infected components are kept in
+        sync. Untouched components are never revisited. Finally, new or
+        merged uninfected components are infected, largest first, to
+        reach min_users, and whole infected ones among them are cured,
+        smallest first, to get back under max_users.
+
+        Returns True if the infection is consistent and has between
+        min_users and max_users users (inclusive), False otherwise.
+        """
+
+        touched = set()
+        for user in new_users:
+            if user.id() in self._sets:
+                continue # Don't overwrite users or their components
+            self._graph.add_node(user)
+            self._add_user(user)
+            if self._feature in user.features():
+                self._infect(user)
+            touched.add(user.id())
+
+        edges = []
+        for coach_id, student_id in new_edges:
+            coach = self._graph.find_node(coach_id)
+            student = self._graph.find_node(student_id)
+            self._graph.add_edge(coach, student)
+            self._union(coach, student)
+            edges.append((coach, student))
+            touched.add(coach_id)
+
+        roots = set(self._sets.find(x) for x in touched)
+        for root in roots:
+            if self._whole[root] and (
+                    0 < self._counts[root] < self._sets.size(root)):
+                self._repair_component(root, min_users, max_users)
+
+        consistent = self._repair_classes(edges, max_users)
+
+        whole_roots = sorted([x for x in roots if self._whole[x]],
+                key=self._sets.size)
+        for root in reversed(whole_roots):
+            size = self._sets.size(root)
+            if len(self.infected) >= min_users:
+                break
+            if self._counts[root] == 0 and (
+                    len(self.infected) + size <= max_users):
+                for user in component_members(self._graph.find_node(root)):
+                    self._infect(user)
+
+        for root in whole_roots:
+            size = self._sets.size(root)
+            if len(self.infected) <= max_users:
+                break
+            if self._counts[root] == size and (
+                    len(self.infected) - size >= min_users):
+                for user in component_members(self._graph.find_node(root)):
+                    self._cure(user)
+
+        return consistent and min_users <= len(self.infected) <= max_users